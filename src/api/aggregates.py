@@ -0,0 +1,93 @@
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from api.models import (
+    Order,
+    Payment,
+    DailyOrderTotal,
+    DailyShipmentTotal,
+    DailyPaymentTotal
+)
+
+DAILY_TOTALS = (DailyOrderTotal, DailyShipmentTotal, DailyPaymentTotal)
+
+# advisory locks taken by every refresh on each date it recomputes, two
+# refreshes of the same day would otherwise insert its rows twice
+REFRESH_LOCK = 130013
+
+# dates a full rebuild recomputes per transaction
+REBUILD_BATCH = 100
+
+
+def refresh_daily_totals(dates=None):
+    """
+    Recompute the daily totals of the given order dates, or of every date
+    when none are given, with one grouped query per totals table.
+
+    Refreshes only lock the dates they recompute, so writes on other days
+    never wait on each other, and a full rebuild goes through the dates in
+    batches instead of holding them all at once.
+    """
+    if dates is None:
+        # totals left on days that no longer have orders are removed too
+        dates = set()
+        for model in (Order, ) + DAILY_TOTALS:
+            dates.update(model.objects.order_by().values_list(
+                'date', flat=True).distinct())
+        dates = sorted(dates)
+        for i in range(0, len(dates), REBUILD_BATCH):
+            refresh_daily_totals(dates[i:i + REBUILD_BATCH])
+        return
+    dates = sorted(set(dates) - {None})
+    if not dates:
+        return
+    orders = Order.objects.filter(date__in=dates)
+    shipments = Order.products.through.objects.filter(order__date__in=dates)
+    payments = Payment.objects.filter(order__date__in=dates)
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # in date order, so overlapping refreshes can not deadlock
+            for day in dates:
+                cursor.execute(
+                    'SELECT pg_advisory_xact_lock(%s, %s)',
+                    [REFRESH_LOCK, day.toordinal()]
+                )
+        for model in DAILY_TOTALS:
+            model.objects.filter(date__in=dates).delete()
+        DailyOrderTotal.objects.bulk_create(
+            DailyOrderTotal(**row) for row in orders.values('date').annotate(
+                orders=Count('pk'),
+                revenue=Sum('total_amount')
+            )
+        )
+        DailyShipmentTotal.objects.bulk_create(
+            DailyShipmentTotal(**row) for row in shipments.values(
+                date=F('order__date'),
+                flavour_id=F('product__flavour'),
+                container_id=F('product__container')
+            ).annotate(
+                kegs=Count('pk'),
+                liters=Sum('product__container__liters')
+            )
+        )
+        DailyPaymentTotal.objects.bulk_create(
+            DailyPaymentTotal(**row) for row in payments.values(
+                'method',
+                date=F('order__date')
+            ).annotate(
+                payments=Count('pk'),
+                amount=Sum('amount')
+            )
+        )
+
+
+def order_dates(**lookups):
+    return Order.objects.filter(**lookups).values_list(
+        'date', flat=True
+    ).distinct()
+
+
+def refresh_on_commit(dates):
+    # totals are recomputed from committed rows, once the write is visible
+    dates = set(dates)
+    transaction.on_commit(lambda: refresh_daily_totals(dates))
@@ -0,0 +1,108 @@
+from django.core.cache import cache
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from api.models import Customer, Order, Payment, Quota
+from api.versions import get_versions
+from decimal import Decimal
+
+# old versions are never read again, let them expire
+BALANCES_TIMEOUT = 60 * 60 * 24
+
+
+def total(queryset, customer_lookup, field):
+    # correlated SUM of `field` over the rows of the outer customer
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{customer_lookup: OuterRef('pk')}).order_by()
+            .values(customer_lookup).annotate(total=Sum(field))
+            .values('total')
+        ),
+        Value(0),
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+
+
+def get_balances(pk=None):
+    """
+    Return {customer pk: balance} for every customer, or only the one with
+    `pk`, where a balance holds what the customer `ordered`, what was
+    `paid` for those orders, the `due` difference and the value of
+    `outstanding_quotas`, the installments dated after today.
+
+    Computed with one query and kept in the shared cache until an order,
+    payment, quota or customer is written, or the day changes.
+    """
+    today = timezone.localdate()
+    key = 'balances:%s:%s:%s' % (
+        'all' if pk is None else pk,
+        today.isoformat(),
+        '-'.join(
+            v.isoformat()
+            for v in get_versions(Customer, Order, Payment, Quota)
+        )
+    )
+    balances = cache.get(key)
+    if balances is None:
+        customers = Customer.objects.all()
+        if pk is not None:
+            customers = customers.filter(pk=pk)
+        customers = customers.annotate(
+            ordered=total(Order.objects.all(), 'customer', 'total_amount'),
+            paid=total(Payment.objects.all(), 'order__customer', 'amount'),
+            outstanding_quotas=total(
+                Quota.objects.filter(date__gt=today),
+                'payment__order__customer',
+                'value'
+            ),
+        ).values('pk', 'name', 'ordered', 'paid', 'outstanding_quotas')
+        balances = {
+            customer['pk']: dict(
+                customer, due=customer['ordered'] - customer['paid']
+            )
+            for customer in customers
+        }
+        cache.set(key, balances, BALANCES_TIMEOUT)
+    return balances
+
+
+def get_payment_quotas(payments):
+    """
+    Return, for each payment pk in `payments`, its quotas in order with the
+    sums `paid`, of the quotas dated up to today in TIME_ZONE, and
+    `remaining`, of the ones after it. `paid` follows the schedule only,
+    not the money actually received.
+
+    The quotas of all the payments come from one query on the
+    (payment, current_quota) index and are kept in the shared cache until
+    a quota is written, or the day changes.
+    """
+    today = timezone.localdate()
+    key = 'payment_quotas:%s:%s:%s' % (
+        today.isoformat(),
+        get_versions(Quota)[0].isoformat(),
+        ','.join(str(pk) for pk in payments),
+    )
+    summaries = cache.get(key)
+    if summaries is None:
+        summaries = {
+            pk: {
+                'payment': pk,
+                'paid': Decimal(0),
+                'remaining': Decimal(0),
+                'quotas': [],
+            }
+            for pk in payments
+        }
+        quotas = Quota.objects.filter(payment__in=payments).order_by(
+            'payment', 'current_quota'
+        ).values('payment', 'pk', 'current_quota', 'total_quota', 'value',
+                 'date')
+        for quota in quotas:
+            summary = summaries[quota.pop('payment')]
+            summary['paid' if quota['date'] <= today else 'remaining'] += \
+                quota['value']
+            summary['quotas'].append(quota)
+        summaries = list(summaries.values())
+        cache.set(key, summaries, BALANCES_TIMEOUT)
+    return summaries
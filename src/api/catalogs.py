@@ -0,0 +1,35 @@
+from django.core.cache import cache
+from api.models import Container, Flavour
+from api.versions import get_versions
+
+# old versions are never read again, let them expire
+CATALOGS_TIMEOUT = 60 * 60 * 24
+
+# (version, catalogs) last loaded by this process
+_local = (None, None)
+
+
+def get_catalogs():
+    """
+    Return the Container and Flavour tables as
+    {'containers': {pk: Container}, 'flavours': {pk: Flavour}}.
+
+    Catalogs are kept in this process and in the shared cache under the
+    current version of both tables; they are only read from the database
+    when a container or flavour has been written since.
+    """
+    global _local
+    version = '-'.join(
+        v.isoformat() for v in get_versions(Container, Flavour)
+    )
+    if _local[0] != version:
+        key = 'catalogs:%s' % version
+        catalogs = cache.get(key)
+        if catalogs is None:
+            catalogs = {
+                'containers': {c.pk: c for c in Container.objects.all()},
+                'flavours': {f.pk: f for f in Flavour.objects.all()},
+            }
+            cache.set(key, catalogs, CATALOGS_TIMEOUT)
+        _local = (version, catalogs)
+    return _local[1]
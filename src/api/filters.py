@@ -0,0 +1,64 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+from api.serializers import SparseFieldsMixin
+
+
+class QueryParamFilter(filters.BaseFilterBackend):
+    """
+    Filters by the lookups listed in the view's `filter_fields` that are
+    present as query parameters, e.g. `?state=Paid&date__gte=2023-01-01`.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        return self.filter_lookups(
+            request, queryset, getattr(view, 'filter_fields', ())
+        )
+
+    def filter_lookups(self, request, queryset, lookups):
+        filters = {}
+        for lookup in lookups:
+            if lookup not in request.query_params:
+                continue
+            field = queryset.model._meta.get_field(lookup.split('__')[0])
+            try:
+                filters[lookup] = field.to_python(
+                    request.query_params[lookup]
+                )
+            except DjangoValidationError as e:
+                raise ValidationError({lookup: e.messages})
+        return queryset.filter(**filters)
+
+
+class OrderingFilter(filters.OrderingFilter):
+    """
+    `?ordering=` restricted to the view's `ordering_fields` (none when
+    unset). Falls back to the view's `ordering`, or `pk`, so lists and
+    cursor pagination always come in a stable order.
+    """
+    ordering_fields = ()
+
+    def get_default_ordering(self, view):
+        return super().get_default_ordering(view) or ('pk', )
+
+
+class SparseFieldsFilter(filters.BaseFilterBackend):
+    """
+    Loads only the columns asked for in `?fields=` when the view's
+    serializer supports sparse fieldsets.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if request.method != 'GET' or \
+                not issubclass(view.get_serializer_class(), SparseFieldsMixin):
+            return queryset
+        requested = SparseFieldsMixin.requested_fields(request)
+        columns = {
+            field.name for field in queryset.model._meta.concrete_fields
+        } & requested
+        if not columns:
+            return queryset
+        # relations joined with select_related can not be deferred
+        if isinstance(queryset.query.select_related, dict):
+            columns.update(queryset.query.select_related)
+        return queryset.only(*columns)
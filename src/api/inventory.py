@@ -0,0 +1,133 @@
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from api.models import Product, ProductCount
+from api.versions import touch
+from collections import Counter
+
+# what a product is counted under in ProductCount
+PRODUCT_KEY = ('flavour_id', 'container_id', 'state')
+
+
+def product_key(product):
+    return tuple(product.__dict__.get(field) for field in PRODUCT_KEY)
+
+
+def lock_product_keys(pks):
+    """
+    Lock the products `pks` until the transaction ends and return the keys
+    their rows are counted under now, by pk. Counters move from these
+    rather than from the values an instance was loaded with, which a
+    concurrent write may have changed since.
+    """
+    return {
+        row[0]: row[1:] for row in Product.objects.select_for_update().filter(
+            pk__in=pks
+        ).order_by('pk').values_list('pk', *PRODUCT_KEY)
+    }
+
+
+def saved_product_key(product, current, update_fields=None):
+    """
+    The key `product` is counted under once saved: the fields a save
+    leaves alone, because of `update_fields` or because they are deferred,
+    keep the value of `current`, the key its row held before.
+    """
+    if update_fields is None or current is None:
+        return product_key(product)
+    saved = {Product._meta.get_field(name).attname for name in update_fields}
+    return tuple(
+        product.__dict__[field] if field in saved else value
+        for field, value in zip(PRODUCT_KEY, current)
+    )
+
+
+def adjust_product_counts(changes):
+    """
+    Apply `changes`, pairs of the keys products were counted under before
+    and after a write (None for a created or deleted product), to
+    ProductCount. Call it inside the transaction of the write, with the
+    old keys read under lock_product_keys().
+    """
+    deltas = Counter()
+    for old, new in changes:
+        if old == new:
+            continue
+        for key, delta in ((old, -1), (new, 1)):
+            if key is not None:
+                deltas[key] += delta
+    table = connection.ops.quote_name(ProductCount._meta.db_table)
+    with connection.cursor() as cursor:
+        # rows are always locked in key order, whichever way products move,
+        # so concurrent writes can not deadlock on them
+        for key, n in sorted(deltas.items()):
+            if n > 0:
+                cursor.execute(
+                    'INSERT INTO %s (flavour_id, container_id, state, count) '
+                    'VALUES (%%s, %%s, %%s, %%s) '
+                    'ON CONFLICT (flavour_id, container_id, state) '
+                    'DO UPDATE SET count = %s.count + EXCLUDED.count' % (
+                        table, table),
+                    [*key, n]
+                )
+            elif n < 0:
+                # only an update, the counter of a flavour or container
+                # deleted with its products is gone already
+                cursor.execute(
+                    'UPDATE %s SET count = count + %%s WHERE flavour_id = %%s '
+                    'AND container_id = %%s AND state = %%s' % table,
+                    [n, *key]
+                )
+
+
+def rebuild_product_counts():
+    """
+    Recompute ProductCount from the products table with one GROUP BY.
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # writers wait for the new counts before adjusting them
+            cursor.execute('LOCK TABLE %s IN EXCLUSIVE MODE' % (
+                connection.ops.quote_name(ProductCount._meta.db_table)
+            ))
+        ProductCount.objects.all().delete()
+        ProductCount.objects.bulk_create(
+            ProductCount(**row) for row in Product.objects.order_by().values(
+                *PRODUCT_KEY
+            ).annotate(count=Count('pk'))
+        )
+
+
+def allocate_products(order, flavour, container, quantity):
+    """
+    Reserve `quantity` In Stock kegs of `flavour` in `container` for
+    `order`: they are set In Transit and linked to it in one transaction.
+    Returns the (pk, code) of the kegs; when fewer are free nothing is
+    written.
+
+    Kegs another allocation holds are skipped rather than waited for, so
+    concurrent allocations only queue on the counter rows they share.
+    """
+    with transaction.atomic():
+        kegs = list(
+            Product.objects.select_for_update(skip_locked=True).filter(
+                flavour=flavour, container=container, state='In Stock'
+            ).order_by('pk').values_list('pk', 'code')[:quantity]
+        )
+        if len(kegs) < quantity:
+            raise ValidationError({'quantity': [
+                'Only %s kegs in stock.' % len(kegs)
+            ]})
+        pks = [pk for pk, code in kegs]
+        Product.objects.filter(pk__in=pks).update(
+            state='In Transit', updated_at=timezone.now()
+        )
+        # bulk queries send no post_save signal, the m2m add does
+        touch(Product)
+        order.products.add(*pks)
+        key = (flavour.pk, container.pk)
+        adjust_product_counts(
+            [(key + ('In Stock', ), key + ('In Transit', ))] * quantity
+        )
+    return kegs
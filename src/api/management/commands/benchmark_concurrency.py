@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+import json
+import statistics
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test a running server: send the same GET request from an '
+        'increasing number of concurrent connections and report throughput '
+        'and p50/p99 latency at each level. Run it against the server '
+        'started with SERVER_MODE=wsgi and with SERVER_MODE=asgi to compare '
+        'how they scale.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000')
+        parser.add_argument('--path', default='/api/order/')
+        parser.add_argument('--username', required=True)
+        parser.add_argument('--password', required=True)
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[1, 8, 32, 64])
+        parser.add_argument('--requests', type=int, default=500)
+
+    def handle(self, *args, **options):
+        token = self.obtain_token(options)
+        request = Request(
+            options['url'] + options['path'],
+            headers={'Authorization': 'Bearer %s' % token},
+        )
+
+        def timed(_):
+            start = time.perf_counter()
+            with urlopen(request) as response:
+                response.read()
+            return (time.perf_counter() - start) * 1000
+
+        for concurrency in options['concurrency']:
+            with ThreadPoolExecutor(concurrency) as pool:
+                start = time.perf_counter()
+                try:
+                    timings = list(pool.map(timed, range(options['requests'])))
+                except URLError as e:
+                    raise CommandError(e)
+                elapsed = time.perf_counter() - start
+            percentiles = statistics.quantiles(timings, n=100)
+            self.stdout.write(
+                '%3s connections: %7.1f req/s, p50 %7.2f ms, p99 %7.2f ms' % (
+                    concurrency,
+                    len(timings) / elapsed,
+                    percentiles[49],
+                    percentiles[98],
+                )
+            )
+
+    def obtain_token(self, options):
+        request = Request(
+            options['url'] + '/api/auth/token/',
+            data=json.dumps({
+                'username': options['username'],
+                'password': options['password'],
+            }).encode(),
+            headers={'Content-Type': 'application/json'},
+        )
+        try:
+            with urlopen(request) as response:
+                return json.loads(response.read())['access']
+        except URLError as e:
+            raise CommandError(e)
@@ -0,0 +1,79 @@
+from django.contrib.auth.models import User
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from api.models import Customer
+from wsgiref.util import setup_testing_defaults
+import statistics
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare p50/p99 latency of an API list request when every request '
+        'opens a new database connection (CONN_MAX_AGE=0) and when '
+        'connections are kept open as configured. Requests go through '
+        'Django\'s WSGI handler in this process, as under gunicorn; the '
+        'throw-away user and customers are deleted at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--customers', type=int, default=50)
+        parser.add_argument('--path', default='/api/customer/')
+
+    def handle(self, *args, **options):
+        user = User.objects.create(username='bench_connections')
+        customers = Customer.objects.bulk_create(
+            Customer(
+                name='bench %s' % i,
+                address='address',
+                email='bench%s@bench.com' % i,
+                cellphone='000000',
+                type='Particular',
+            )
+            for i in range(options['customers'])
+        )
+        token = RefreshToken.for_user(user).access_token
+        environ = {
+            'PATH_INFO': options['path'],
+            'HTTP_AUTHORIZATION': 'Bearer %s' % token,
+        }
+        setup_testing_defaults(environ)
+        configured = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            with override_settings(ALLOWED_HOSTS=[environ['HTTP_HOST']]):
+                for max_age in (0, configured):
+                    connection.close()
+                    connection.settings_dict['CONN_MAX_AGE'] = max_age
+                    self.run(WSGIHandler(), environ, options, max_age)
+        finally:
+            connection.settings_dict['CONN_MAX_AGE'] = configured
+            Customer.objects.filter(
+                pk__in=[c.pk for c in customers]).delete()
+            user.delete()
+
+    def run(self, handler, environ, options, max_age):
+        statuses = []
+        timings = []
+        for _ in range(options['requests']):
+            start = time.perf_counter()
+            response = handler(
+                dict(environ),
+                lambda status, headers: statuses.append(status)
+            )
+            b''.join(response)
+            # sends request_finished, which closes the connection when
+            # it is not persistent
+            response.close()
+            timings.append((time.perf_counter() - start) * 1000)
+            if not statuses[-1].startswith('200'):
+                self.stderr.write(statuses[-1])
+                return
+        percentiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            'CONN_MAX_AGE=%s' % max_age))
+        self.stdout.write('p50 %.2f ms, p99 %.2f ms' % (
+            percentiles[49], percentiles[98]))
@@ -0,0 +1,102 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from api.models import (
+    Customer,
+    Container,
+    Flavour,
+    Product,
+    Order,
+    Payment,
+    Quota
+)
+from datetime import date, timedelta
+
+SEED_SQL = [
+    """INSERT INTO {customer} (name, address, email, cellphone, type)
+    SELECT 'bench ' || i, 'address', 'bench' || i || '@bench.com',
+        '000000', 'Particular'
+    FROM generate_series(1, 1000) AS i""",
+    """INSERT INTO {container} (type, liters) VALUES ('Keg', 50)""",
+    """INSERT INTO {flavour} (name, description, price_per_lt)
+    VALUES ('bench', 'bench', 1)""",
+    # most kegs are historic Empty ones, as in production
+    """INSERT INTO {product} (code, container_id, flavour_id, arrived_date,
+        price, state)
+    SELECT 'b' || (i %% 10000), (SELECT MAX(id) FROM {container}),
+        (SELECT MAX(id) FROM {flavour}), CURRENT_DATE - (i %% 3650), 1,
+        CASE i %% 100 WHEN 0 THEN 'In Stock' WHEN 1 THEN 'In Transit'
+        ELSE 'Empty' END
+    FROM generate_series(1, %(rows)s) AS i""",
+    """INSERT INTO {order} (date, price, delivery_cost, total_amount,
+        customer_id, state, comment)
+    SELECT CURRENT_DATE - (i %% 3650), 1, 0, 1,
+        (SELECT MAX(id) FROM {customer}) - (i %% 1000),
+        CASE WHEN i %% 50 = 0 THEN 'Pending' ELSE 'Paid' END, 'bench'
+    FROM generate_series(1, %(rows)s) AS i""",
+    # negative numbers never collide with the transaction sequence
+    """INSERT INTO {payment} (transaction, amount, method, order_id)
+    SELECT -id, 1, 'Cash', id FROM {order} WHERE comment = 'bench'""",
+    """INSERT INTO {quota} (current_quota, total_quota, value, date,
+        payment_id)
+    SELECT 1, 1, 1, CURRENT_DATE, id FROM {payment} WHERE transaction < 0""",
+    """INSERT INTO {user} (password, is_superuser, username, first_name,
+        last_name, email, is_staff, is_active, date_joined)
+    SELECT '', false, 'bench' || i, '', '', 'bench' || i || '@bench.com',
+        false, true, NOW()
+    FROM generate_series(1, %(rows)s) AS i""",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throw-away dataset and compare query plans of the API '
+        'filter paths with and without index scans. Everything runs in a '
+        'transaction that is rolled back at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+
+    def handle(self, *args, **options):
+        tables = {
+            model.__name__.lower(): connection.ops.quote_name(
+                model._meta.db_table)
+            for model in (
+                Customer, Container, Flavour, Product, Order, Payment,
+                Quota, User
+            )
+        }
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                self.stdout.write('Seeding %s rows...' % options['rows'])
+                for sql in SEED_SQL:
+                    cursor.execute(
+                        sql.format(**tables), {'rows': options['rows']})
+                cursor.execute('ANALYZE')
+
+            payment = Payment.objects.filter(transaction__lt=0).last()
+            queries = {
+                'generate_report orders': Order.objects.filter(
+                    date__gte=date.today() - timedelta(days=30)),
+                'list_by_payment': Quota.objects.filter(payment=payment),
+                'user by email': User.objects.filter(
+                    email='bench%s@bench.com' % (options['rows'] // 2)),
+                'products by state': Product.objects.filter(
+                    state='In Transit'),
+                'pending orders by date': Order.objects.filter(
+                    state='Pending').order_by('-date')[:100],
+            }
+            for title, queryset in queries.items():
+                self.stdout.write(self.style.MIGRATE_HEADING(title))
+                self.explain(queryset, index_scans=False)
+                self.explain(queryset, index_scans=True)
+            transaction.set_rollback(True)
+
+    def explain(self, queryset, index_scans):
+        setting = 'on' if index_scans else 'off'
+        with connection.cursor() as cursor:
+            for scan in ('indexscan', 'bitmapscan', 'indexonlyscan'):
+                cursor.execute('SET LOCAL enable_%s = %s' % (scan, setting))
+        self.stdout.write('index scans %s:' % setting)
+        self.stdout.write(queryset.explain(analyze=True))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Check that every migration is applied to the database, waiting up '
+        'to --wait seconds for a running release job. Used instead of '
+        'migrate when an API replica starts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wait', type=int, default=0)
+
+    def handle(self, *args, **options):
+        deadline = time.monotonic() + options['wait']
+        while True:
+            executor = MigrationExecutor(connection)
+            plan = executor.migration_plan(
+                executor.loader.graph.leaf_nodes())
+            if not plan:
+                return
+            if time.monotonic() >= deadline:
+                raise CommandError(
+                    'Unapplied migrations, run the release job: %s' %
+                    ', '.join('%s.%s' % (m.app_label, m.name) for m, _ in plan)
+                )
+            time.sleep(2)
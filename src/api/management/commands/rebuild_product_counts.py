@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from api.inventory import PRODUCT_KEY, rebuild_product_counts
+from api.models import ProductCount
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconcile the keg availability counters with the products table: '
+        'recount them with a single GROUP BY and report the counters that '
+        'had drifted.'
+    )
+
+    def handle(self, *args, **options):
+        before = self.counts()
+        rebuild_product_counts()
+        after = self.counts()
+        drifted = [
+            (key, before.get(key, 0), after.get(key, 0))
+            for key in sorted(before.keys() | after.keys())
+            if before.get(key, 0) != after.get(key, 0)
+        ]
+        for key, old, new in drifted:
+            self.stdout.write('%s: %s -> %s' % (
+                ' / '.join(str(value) for value in key), old, new))
+        self.stdout.write(self.style.SUCCESS(
+            '%s counters rebuilt, %s had drifted' % (len(after), len(drifted))
+        ))
+
+    def counts(self):
+        return {
+            row[:-1]: row[-1] for row in
+            ProductCount.objects.values_list(*PRODUCT_KEY, 'count')
+        }
@@ -0,0 +1,26 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+# any constant, the same in every replica running the job
+RELEASE_LOCK = 130020
+
+
+class Command(BaseCommand):
+    help = (
+        'One-shot release job: apply migrations and collect static files. '
+        'Runs under a PostgreSQL advisory lock, so jobs started together by '
+        'several replicas run one after the other and the later ones find '
+        'nothing left to do.'
+    )
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', [RELEASE_LOCK])
+        try:
+            call_command('migrate', interactive=False)
+            call_command('collectstatic', interactive=False)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_advisory_unlock(%s)', [RELEASE_LOCK])
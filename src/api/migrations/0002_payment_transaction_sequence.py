@@ -0,0 +1,35 @@
+# Generated by Django 4.0.4 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                'CREATE SEQUENCE api_payment_transaction_seq '
+                'OWNED BY api_payment.transaction',
+                "SELECT setval('api_payment_transaction_seq', "
+                'COALESCE(MAX(transaction), 0) + 1, false) FROM api_payment',
+                # payments saved concurrently before the sequence existed may
+                # share a number; keep it on the oldest one and renumber the
+                # rest so the unique constraint can be added
+                "UPDATE api_payment SET transaction = "
+                "nextval('api_payment_transaction_seq') WHERE id IN ("
+                'SELECT id FROM (SELECT id, ROW_NUMBER() OVER ('
+                'PARTITION BY transaction ORDER BY id) AS n FROM api_payment'
+                ') AS numbered WHERE n > 1)',
+            ],
+            reverse_sql='DROP SEQUENCE api_payment_transaction_seq',
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='transaction',
+            field=models.IntegerField(editable=False, unique=True),
+        ),
+    ]
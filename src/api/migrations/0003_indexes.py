@@ -0,0 +1,44 @@
+# Generated by Django 4.0.4 on 2026-10-18 12:14
+
+# flake8: noqa
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('api', '0002_payment_transaction_sequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='quota',
+            index=models.Index(fields=['payment', 'current_quota'], name='api_quota_payment_idx'),
+        ),
+        migrations.AlterField(
+            model_name='quota',
+            name='payment',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.payment'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['date'], name='api_order_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['state', 'date'], name='api_order_state_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['state'], name='api_product_state_idx'),
+        ),
+        # auth.User is not ours to add Meta.indexes to, but its email is
+        # looked up on account activation, password reset and signup
+        migrations.RunSQL(
+            sql='CREATE INDEX api_user_email_idx ON auth_user (email)',
+            reverse_sql='DROP INDEX api_user_email_idx',
+        ),
+    ]
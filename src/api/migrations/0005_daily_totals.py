@@ -0,0 +1,91 @@
+# Generated by Django 4.0.4 on 2026-10-18 12:31
+
+# flake8: noqa
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+import django.db.models.deletion
+
+
+def total_orders(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    Payment = apps.get_model('api', 'Payment')
+    DailyOrderTotal = apps.get_model('api', 'DailyOrderTotal')
+    DailyShipmentTotal = apps.get_model('api', 'DailyShipmentTotal')
+    DailyPaymentTotal = apps.get_model('api', 'DailyPaymentTotal')
+    DailyOrderTotal.objects.bulk_create(
+        DailyOrderTotal(**row)
+        for row in Order.objects.order_by().values('date').annotate(
+            orders=Count('pk'),
+            revenue=Sum('total_amount')
+        )
+    )
+    DailyShipmentTotal.objects.bulk_create(
+        DailyShipmentTotal(**row)
+        for row in Order.products.through.objects.order_by().values(
+            date=F('order__date'),
+            flavour_id=F('product__flavour'),
+            container_id=F('product__container')
+        ).annotate(
+            kegs=Count('pk'),
+            liters=Sum('product__container__liters')
+        )
+    )
+    DailyPaymentTotal.objects.bulk_create(
+        DailyPaymentTotal(**row)
+        for row in Payment.objects.order_by().values(
+            'method',
+            date=F('order__date')
+        ).annotate(
+            payments=Count('pk'),
+            amount=Sum('amount')
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOrderTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('orders', models.IntegerField()),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=12)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyPaymentTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('method', models.CharField(choices=[('Debit Card', 'Debit Card'), ('Credit Card', 'Credit Card'), ('Cash', 'Cash'), ('Bank Transfer', 'Bank Transfer'), ('Digital Wallet', 'Digital Wallet'), ('Cryptocurrency', 'Cryptocurrency')], max_length=14)),
+                ('payments', models.IntegerField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyShipmentTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('kegs', models.IntegerField()),
+                ('liters', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('container', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.container')),
+                ('flavour', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.flavour')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailypaymenttotal',
+            constraint=models.UniqueConstraint(fields=('date', 'method'), name='api_daily_payment_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyshipmenttotal',
+            constraint=models.UniqueConstraint(fields=('date', 'flavour', 'container'), name='api_daily_shipment_unique'),
+        ),
+        migrations.RunPython(total_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.0.4 on 2026-10-18 12:59
+
+# flake8: noqa
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def count_products(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    ProductCount = apps.get_model('api', 'ProductCount')
+    ProductCount.objects.bulk_create(
+        ProductCount(**row) for row in Product.objects.order_by().values(
+            'flavour_id', 'container_id', 'state'
+        ).annotate(count=Count('pk'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_daily_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('In Stock', 'In Stock'), ('In Transit', 'In Transit'), ('Empty', 'Empty')], max_length=10)),
+                ('count', models.IntegerField()),
+                ('container', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.container')),
+                ('flavour', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.flavour')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='productcount',
+            constraint=models.UniqueConstraint(fields=('flavour', 'container', 'state'), name='api_product_count_unique'),
+        ),
+        migrations.RunPython(count_products, migrations.RunPython.noop),
+    ]
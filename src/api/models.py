@@ -1,4 +1,8 @@
-from django.db import models
+from django.db import connection, models, transaction
+from api.versions import touch
+from datetime import timedelta
+from decimal import Decimal
+import calendar
 
 # Create your models here.
 
@@ -13,6 +17,7 @@ class Customer(models.Model):
     email = models.EmailField()
     cellphone = models.CharField(max_length=12)
     type = models.CharField(max_length=10, choices=_type)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return '%s (%s)' % (self.name, self.type)
@@ -32,6 +37,7 @@ class Container(models.Model):
 
     type = models.CharField(max_length=7, choices=_type)
     liters = models.DecimalField(max_digits=4, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def select_lts(self):
         return self._available_lts[self.type]
@@ -53,6 +59,7 @@ class Flavour(models.Model):
     name = models.CharField(max_length=15)
     description = models.TextField()
     price_per_lt = models.DecimalField(max_digits=10, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return '%s' % (self.name)
@@ -71,10 +78,22 @@ class Product(models.Model):
     arrived_date = models.DateField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     state = models.CharField(max_length=10, choices=_state)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state'], name='api_product_state_idx'),
+        ]
 
     def __str__(self):
         return '%s - %s' % (self.container, self.flavour)
 
+    def save(self, *args, **kwargs):
+        # the receivers locking the row and adjusting ProductCount run in
+        # the same transaction as the write
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class Order(models.Model):
     _state = [
@@ -90,11 +109,41 @@ class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     state = models.CharField(max_length=9, choices=_state)
     comment = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date'], name='api_order_date_idx'),
+            models.Index(
+                fields=['state', 'date'], name='api_order_state_date_idx'),
+        ]
 
     def __str__(self):
         return '%s - %s' % (self.date, self.customer)
 
 
+def installment_date(start, period, number):
+    if period == 'week':
+        return start + timedelta(weeks=number)
+    # same day of the month, or its last day in shorter months
+    year, month = divmod(start.month - 1 + number, 12)
+    year += start.year
+    day = min(start.day, calendar.monthrange(year, month + 1)[1])
+    return start.replace(year=year, month=month + 1, day=day)
+
+
+class PaymentQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        transactions = Payment.allocate_transactions(len(objs))
+        for payment, number in zip(objs, transactions):
+            payment.transaction = number
+        objs = super().bulk_create(objs, *args, **kwargs)
+        # bulk queries send no post_save signal
+        touch(Payment)
+        return objs
+
+
 class Payment(models.Model):
     _method = [
         ('Debit Card', 'Debit Card'),
@@ -104,20 +153,58 @@ class Payment(models.Model):
         ('Digital Wallet', 'Digital Wallet'),
         ('Cryptocurrency', 'Cryptocurrency'),
     ]
-    transaction = models.IntegerField(default=1)
+    transaction = models.IntegerField(unique=True, editable=False)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     method = models.CharField(max_length=14, choices=_method)
     order = models.OneToOneField(Order, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = PaymentQuerySet.as_manager()
+
+    @staticmethod
+    def allocate_transactions(count):
+        # Numbers come from a database sequence (see migration 0002), so
+        # concurrent inserts never collide and no aggregate is needed
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval('api_payment_transaction_seq') "
+                "FROM generate_series(1, %s)",
+                [count]
+            )
+            return [row[0] for row in cursor.fetchall()]
 
     def save(self, *args, **kwargs):
         if self._state.adding:
-            last_transaction = Payment.objects.all().aggregate(
-                largest=models.Max('transaction')
-                )['largest']
-            if last_transaction is not None:
-                self.transaction = last_transaction + 1
+            self.transaction = Payment.allocate_transactions(1)[0]
         return super(Payment, self).save(*args, **kwargs)
 
+    def schedule_quotas(self, count, start, period):
+        """
+        Replace the quotas of the payment with `count` installments every
+        `period` ('week' or 'month') from `start`, created with one bulk
+        insert. The amount is split in cents, the first quotas taking the
+        ones left over, so the values add up to it exactly.
+        """
+        with transaction.atomic():
+            # concurrent schedules of the payment run one after the other,
+            # each replacing the quotas of the one before
+            payment = Payment.objects.select_for_update().get(pk=self.pk)
+            value, extra = divmod(int(payment.amount.scaleb(2)), count)
+            self.quota_set.all().delete()
+            quotas = Quota.objects.bulk_create(
+                Quota(
+                    current_quota=i + 1,
+                    total_quota=count,
+                    value=Decimal(value + (i < extra)).scaleb(-2),
+                    date=installment_date(start, period, i),
+                    payment=payment,
+                )
+                for i in range(count)
+            )
+            # bulk queries send no post_save signal
+            touch(Quota)
+        return quotas
+
     def __str__(self):
         return self.transaction
 
@@ -127,7 +214,84 @@ class Quota(models.Model):
     total_quota = models.IntegerField()
     value = models.DecimalField(max_digits=10, decimal_places=2)
     date = models.DateField()
-    payment = models.ForeignKey(Payment, on_delete=models.CASCADE)
+    payment = models.ForeignKey(
+        Payment, on_delete=models.CASCADE, db_index=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # also serves plain payment lookups, replacing the FK index
+            models.Index(
+                fields=['payment', 'current_quota'],
+                name='api_quota_payment_idx'
+            ),
+        ]
 
     def __str__(self):
         return '%s/%s' % (self.current_quota, self.total_quota)
+
+
+class DailyOrderTotal(models.Model):
+    date = models.DateField(unique=True)
+    orders = models.IntegerField()
+    revenue = models.DecimalField(max_digits=12, decimal_places=2)
+
+    def __str__(self):
+        return '%s - %s orders' % (self.date, self.orders)
+
+
+class DailyShipmentTotal(models.Model):
+    date = models.DateField()
+    flavour = models.ForeignKey(Flavour, on_delete=models.CASCADE)
+    container = models.ForeignKey(Container, on_delete=models.CASCADE)
+    kegs = models.IntegerField()
+    liters = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'flavour', 'container'],
+                name='api_daily_shipment_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return '%s - %s lt' % (self.date, self.liters)
+
+
+class DailyPaymentTotal(models.Model):
+    date = models.DateField()
+    method = models.CharField(max_length=14, choices=Payment._method)
+    payments = models.IntegerField()
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'method'],
+                name='api_daily_payment_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return '%s - %s' % (self.date, self.method)
+
+
+class ProductCount(models.Model):
+    flavour = models.ForeignKey(Flavour, on_delete=models.CASCADE)
+    container = models.ForeignKey(Container, on_delete=models.CASCADE)
+    state = models.CharField(max_length=10, choices=Product._state)
+    count = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['flavour', 'container', 'state'],
+                name='api_product_count_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return '%s - %s - %s: %s' % (
+            self.container_id, self.flavour_id, self.state, self.count
+        )
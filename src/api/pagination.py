@@ -0,0 +1,126 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+import functools
+import json
+import operator
+
+
+class OptInCursorPagination(CursorPagination):
+    """
+    Keyset pagination in the order given by OrderingFilter (the view's
+    `ordering`, `pk` by default). Lists are only paginated when the client
+    sends `cursor` or `page_size`, so callers expecting the whole list keep
+    working.
+
+    Unlike DRF's cursor, which keeps the first ordering field plus an
+    offset over its ties, the cursor holds the value of every ordering
+    field, `pk` always last, so pages are found by a (value, ..., pk)
+    comparison however many rows share a value.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = 'pk'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params and \
+                self.page_size_query_param not in request.query_params:
+            return None
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        self.position = self.cursor and self.cursor.position
+
+        if reverse:
+            queryset = queryset.order_by(*(
+                field[1:] if field.startswith('-') else '-' + field
+                for field in self.ordering
+            ))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if self.position is not None:
+            try:
+                queryset = queryset.filter(self.after(self.position, reverse))
+            except (DjangoValidationError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        # one extra row tells whether a page follows this one
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next = self.position is not None
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = self.position is not None
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        last = ordering[-1].lstrip('-')
+        if last not in ('pk', queryset.model._meta.pk.name):
+            ordering += ('pk', )
+        return ordering
+
+    def after(self, position, reverse):
+        # rows past `position` in the ordering: a greater (or, for
+        # descending fields, lesser) first value, or an equal one and a
+        # row past it on the next field, and so on
+        conditions = []
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = '__gt' if field.startswith('-') == reverse else '__lt'
+            conditions.append(Q(**equal, **{name + lookup: value}))
+            equal[name] = value
+        return functools.reduce(operator.or_, conditions)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=self.page_position(-1))
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position=self.page_position(0))
+        )
+
+    def page_position(self, index):
+        # an empty page continues from the cursor that led to it
+        if not self.page:
+            return json.dumps(self.position)
+        return self._get_position_from_instance(
+            self.page[index], self.ordering
+        )
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is None or cursor.position is None:
+            return cursor
+        try:
+            position = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or \
+                len(position) != len(self.ordering) or \
+                not all(isinstance(value, str) for value in position):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor._replace(position=position)
+
+    def _get_position_from_instance(self, instance, ordering):
+        return json.dumps([
+            str(instance[field.lstrip('-')] if isinstance(instance, dict)
+                else getattr(instance, field.lstrip('-')))
+            for field in ordering
+        ])
@@ -0,0 +1,71 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework import renderers
+from io import StringIO
+import abc
+import csv
+
+# rows are sent in pieces of about this many characters
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class StreamingRenderer(renderers.BaseRenderer, metaclass=abc.ABCMeta):
+    """
+    Encodes rows of `columns` one at a time with `stream`, for views
+    returning a StreamingHttpResponse. `render` is only used for error
+    responses.
+    """
+    charset = 'utf-8'
+
+    def stream(self, columns, rows):
+        buffer = StringIO()
+        write_row = self.row_writer(buffer, columns)
+        # the header goes out before the first row is fetched
+        yield buffer.getvalue().encode(self.charset)
+        buffer.seek(0)
+        buffer.truncate()
+        for row in rows:
+            write_row(row)
+            if buffer.tell() >= STREAM_CHUNK_SIZE:
+                yield buffer.getvalue().encode(self.charset)
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode(self.charset)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            columns, rows = ('field', 'detail'), data.items()
+        else:
+            columns, rows = ('detail', ), [(item, ) for item in data]
+        return b''.join(self.stream(columns, rows))
+
+    @abc.abstractmethod
+    def row_writer(self, buffer, columns):
+        """
+        Write the header for `columns` to `buffer` and return a function
+        writing one row to it.
+        """
+
+
+class CSVRenderer(StreamingRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def row_writer(self, buffer, columns):
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        return writer.writerow
+
+
+class NDJSONRenderer(StreamingRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def row_writer(self, buffer, columns):
+        encoder = DjangoJSONEncoder()
+
+        def write_row(row):
+            buffer.write(encoder.encode(dict(zip(columns, row))))
+            buffer.write('\n')
+        return write_row
@@ -1,6 +1,17 @@
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils.functional import cached_property
 from rest_framework import serializers
+from api.aggregates import order_dates, refresh_on_commit
+from api.catalogs import get_catalogs
+from api.inventory import (
+    adjust_product_counts,
+    lock_product_keys,
+    product_key,
+    saved_product_key
+)
+from api.versions import touch
 from api.models import (
     Customer,
     Container,
@@ -8,10 +19,87 @@ from api.models import (
     Product,
     Order,
     Payment,
-    Quota
+    Quota,
+    installment_date
 )
 
 
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    Persists a list payload with a single bulk_create / bulk_update
+    inside one transaction.
+    """
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        with transaction.atomic():
+            instances = model.objects.bulk_create(
+                [model(**attrs) for attrs in validated_data]
+            )
+            # bulk queries send no post_save signal
+            touch(model)
+            if model is Product:
+                adjust_product_counts(
+                    [(None, product_key(product)) for product in instances]
+                )
+        return instances
+
+    def update(self, instances, validated_data):
+        # instances are expected in the same order as the payload items
+        model = self.child.Meta.model
+        fields = set()
+        for instance, attrs in zip(instances, validated_data):
+            for attr, value in attrs.items():
+                setattr(instance, attr, value)
+            fields.update(attrs)
+        if fields:
+            auto_now = [
+                field for field in model._meta.concrete_fields
+                if getattr(field, 'auto_now', False)
+            ]
+            for field in auto_now:
+                for instance in instances:
+                    field.pre_save(instance, add=False)
+                fields.add(field.name)
+            with transaction.atomic():
+                if model is Product:
+                    current = lock_product_keys(
+                        [instance.pk for instance in instances])
+                model.objects.bulk_update(instances, fields)
+                touch(model)
+                if model is Product:
+                    # a product listed twice moves once
+                    products = {p.pk: p for p in instances}.values()
+                    adjust_product_counts([
+                        (current[product.pk], saved_product_key(
+                            product, current[product.pk], fields))
+                        for product in products if product.pk in current
+                    ])
+                    refresh_on_commit(order_dates(products__in=instances))
+        return instances
+
+
+class SparseFieldsMixin:
+    """
+    Keeps only the fields listed in a `?fields=pk,code,...` query
+    parameter when serializing the response to a GET request.
+    """
+
+    @staticmethod
+    def requested_fields(request):
+        if request is None or request.method != 'GET':
+            return set()
+        fields = request.query_params.get('fields', '')
+        return {field.strip() for field in fields.split(',') if field.strip()}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.requested_fields(self.context.get('request'))
+        if requested & set(self.fields):
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+
 class UserSerializer(serializers.ModelSerializer):
     email = serializers.EmailField()
     is_active = serializers.BooleanField(
@@ -51,37 +139,49 @@ class UserNewPassSerializer(serializers.Serializer):
     password = serializers.CharField()
 
 
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Customer
         fields = ('pk', 'name', 'address', 'email', 'cellphone', 'type')
 
 
-class ContainerSerializer(serializers.ModelSerializer):
+class ContainerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Container
         fields = ('pk', 'type', 'liters')
 
 
-class FlavourSerializer(serializers.ModelSerializer):
+class FlavourSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Flavour
         fields = ('pk', 'name', 'description', 'price_per_lt')
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+
+    @cached_property
+    def catalogs(self):
+        # one lookup per serializer, which is shared by all rows of a list
+        return get_catalogs()
 
     def to_representation(self, instance):
+        # container and flavour labels come from the cached catalogs, so no
+        # query is made per product
         representation = super().to_representation(instance)
-        container_data = Container.objects.get(pk=representation['container'])
-        representation['container'] = '%s - %s lt' \
-            % (container_data.type, container_data.liters)
-        representation['flavour'] = Flavour.objects.get(
-            pk=representation['flavour']).name
+        if 'container' in representation:
+            container = self.catalogs['containers'].get(
+                instance.container_id) or instance.container
+            representation['container'] = '%s - %s lt' \
+                % (container.type, container.liters)
+        if 'flavour' in representation:
+            flavour = self.catalogs['flavours'].get(
+                instance.flavour_id) or instance.flavour
+            representation['flavour'] = flavour.name
         return representation
 
     class Meta:
         model = Product
+        list_serializer_class = BulkListSerializer
         fields = (
             'pk',
             'code',
@@ -93,17 +193,18 @@ class ProductSerializer(serializers.ModelSerializer):
         )
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     def to_representation(self, instance):
+        # products and customer come from the prefetch/select_related of
+        # OrderViewSet.queryset, so no extra query is made per order
         representation = super().to_representation(instance)
-        representation['products'] = [
-            p.code for p in Product.objects.filter(
-                pk__in=representation['products']
-            )
-        ]
-        representation['customer'] = Customer.objects.get(
-            pk=representation['customer']).name
+        if 'products' in representation:
+            representation['products'] = [
+                p.code for p in instance.products.all()
+            ]
+        if 'customer' in representation:
+            representation['customer'] = instance.customer.name
         return representation
 
     class Meta:
@@ -121,15 +222,24 @@ class OrderSerializer(serializers.ModelSerializer):
         )
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class AllocationSerializer(serializers.Serializer):
+    flavour = serializers.PrimaryKeyRelatedField(
+        queryset=Flavour.objects.all())
+    container = serializers.PrimaryKeyRelatedField(
+        queryset=Container.objects.all())
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class PaymentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = ('pk', 'transaction', 'amount', 'method', 'order')
 
 
-class QuotaSerializer(serializers.ModelSerializer):
+class QuotaSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Quota
+        list_serializer_class = BulkListSerializer
         fields = (
             'pk',
             'current_quota',
@@ -140,9 +250,37 @@ class QuotaSerializer(serializers.ModelSerializer):
         )
 
 
+class InstallmentsSerializer(serializers.Serializer):
+    count = serializers.IntegerField(min_value=1, max_value=120)
+    start_date = serializers.DateField()
+    period = serializers.ChoiceField(choices=('week', 'month'))
+
+    def validate(self, attrs):
+        # installments only move forward, the last one must still be a date
+        try:
+            installment_date(
+                attrs['start_date'], attrs['period'], attrs['count'] - 1)
+        except (OverflowError, ValueError):
+            raise serializers.ValidationError(
+                {'start_date': ['The last installment falls after 9999.']}
+            )
+        return attrs
+
+
 class QuotasByPaymentSerializer(serializers.Serializer):
     payment = serializers.IntegerField()
 
 
+class CustomerBalanceSerializer(serializers.Serializer):
+    pk = serializers.IntegerField()
+    name = serializers.CharField()
+    ordered = serializers.DecimalField(max_digits=12, decimal_places=2)
+    paid = serializers.DecimalField(max_digits=12, decimal_places=2)
+    due = serializers.DecimalField(max_digits=12, decimal_places=2)
+    outstanding_quotas = serializers.DecimalField(
+        max_digits=12, decimal_places=2
+    )
+
+
 class ReportSerializer(serializers.Serializer):
     date_from = serializers.DateField()
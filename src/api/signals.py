@@ -0,0 +1,145 @@
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save
+)
+from django.core.signals import request_started
+from django.db import connections
+from django.dispatch import receiver
+from api.models import (
+    Customer,
+    Container,
+    Flavour,
+    Product,
+    Order,
+    Payment,
+    Quota
+)
+from api.aggregates import order_dates, refresh_on_commit
+from api.inventory import (
+    adjust_product_counts,
+    lock_product_keys,
+    saved_product_key
+)
+from api.versions import touch
+
+VERSIONED_MODELS = (
+    Customer,
+    Container,
+    Flavour,
+    Product,
+    Order,
+    Payment,
+    Quota
+)
+
+
+def table_changed(sender, **kwargs):
+    touch(sender)
+
+
+for model in VERSIONED_MODELS:
+    post_save.connect(table_changed, sender=model)
+    post_delete.connect(table_changed, sender=model)
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_changed(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    touch(Order)
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        refresh_on_commit([instance.date])
+    elif action == 'pre_clear':
+        refresh_on_commit(order_dates(products=instance))
+    else:
+        refresh_on_commit(order_dates(pk__in=pk_set))
+
+
+# Daily totals are refreshed for the order dates a write touches, including
+# the ones its row held before when the write moves it elsewhere. Those are
+# read from the row as the write starts rather than kept from whenever the
+# instance was loaded, so loading rows costs nothing and a stale instance
+# can not hide the date it was moved away from.
+
+TRACKED_FIELDS = {
+    Order: ('date', ),
+    Payment: ('order_id', ),
+}
+
+
+def read_current(sender, instance, **kwargs):
+    row = None if instance.pk is None else \
+        sender._base_manager.filter(pk=instance.pk).values_list(
+            *TRACKED_FIELDS[sender]).first()
+    instance._current = row or ()
+
+
+for model in TRACKED_FIELDS:
+    pre_save.connect(read_current, sender=model)
+    pre_delete.connect(read_current, sender=model)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def order_changed(sender, instance, **kwargs):
+    refresh_on_commit([instance.date, *instance._current])
+
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def payment_changed(sender, instance, **kwargs):
+    refresh_on_commit(
+        order_dates(pk__in=[instance.order_id, *instance._current])
+    )
+
+
+# Product counts move from the key the row holds, read under a row lock in
+# the transaction of the write, to the one it is saved with.
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_delete, sender=Product)
+def product_locked(sender, instance, **kwargs):
+    instance._current = None if instance.pk is None else \
+        lock_product_keys([instance.pk]).get(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def product_changed(sender, instance, update_fields, **kwargs):
+    current = instance._current
+    key = saved_product_key(instance, current, update_fields)
+    adjust_product_counts([(current, key)])
+    if current is not None and current[:2] != key[:2]:
+        refresh_on_commit(order_dates(products=instance))
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    # its order links are deleted along with it without m2m_changed
+    refresh_on_commit(order_dates(products=instance))
+
+
+@receiver(post_delete, sender=Product)
+def product_removed(sender, instance, **kwargs):
+    adjust_product_counts([(instance._current, None)])
+
+
+@receiver(post_save, sender=Container)
+def container_changed(sender, instance, created, **kwargs):
+    if not created:
+        refresh_on_commit(order_dates(products__container=instance))
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    # CONN_HEALTH_CHECKS is only built in from Django 4.1: a persistent
+    # connection the server dropped while idle is replaced before the
+    # request uses it, instead of failing its first query
+    for conn in connections.all():
+        if conn.connection is not None and \
+                conn.settings_dict.get('CONN_HEALTH_CHECKS') and \
+                not conn.is_usable():
+            conn.close()
@@ -1,7 +1,15 @@
-from django.test import TransactionTestCase
+from django.test import AsyncRequestFactory, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.template.loader import get_template
+from django.utils import timezone
 
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from openpyxl import load_workbook
 
 from api.models import (
     Customer,
@@ -10,14 +18,41 @@ from api.models import (
     Flavour,
     Order,
     Payment,
-    Quota
+    Quota,
+    ProductCount,
+    DailyOrderTotal,
+    DailyShipmentTotal,
+    DailyPaymentTotal
 )
-
-from datetime import date, timedelta
+from api import utils, views
+from api import aggregates
+from api.aggregates import refresh_daily_totals
+from api.inventory import allocate_products, rebuild_product_counts
+from birracraft.celery import app
+from api.catalogs import get_catalogs
+
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from asgiref.sync import async_to_sync
+from io import BytesIO, StringIO
+from urllib.parse import urlencode
+import asyncio
+import base64
+import csv
+import gzip
+import json
+import os
+import tempfile
+import threading
+from unittest import mock
 
 
 class TestSetUp(TransactionTestCase):
     def setUp(self):
+        cache.clear()
+        # tasks run in the test process, mails land in mail.outbox
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, 'task_always_eager', False)
         self.register_url = '/api/user/'
         self.testing_payload = {
             'username': 'testing_setup_user',
@@ -123,6 +158,56 @@ class TestUserView(TestSetUp):
             format='json'
         )
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(mail.outbox[-1].to, [self.user_payload['email']])
+        self.assertIn(
+            self.user_payload['username'], mail.outbox[-1].body
+        )
+
+    def test_reset_pass_mail(self):
+        response = self.client.post(
+            self.register_url + 'reset_pass/',
+            data={'email': self.testing_payload['email']},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            mail.outbox[-1].subject, 'Password reset on Birracraft'
+        )
+        self.assertEqual(mail.outbox[-1].to, [self.testing_payload['email']])
+
+    def test_send_mails_batch(self):
+        sent = len(mail.outbox)
+        connection = utils.mail_connection()
+        utils.send_mails.delay([
+            {
+                'template': 'reset_pass_mail.html',
+                'context': {
+                    'username': name,
+                    'protocol': 'http',
+                    'domain': 'testserver',
+                    'uid': name,
+                    'token': 'token',
+                },
+                'subject': 'Password reset on Birracraft',
+                'to': [name + '@gmail.com'],
+            }
+            for name in ('ann', 'bob')
+        ])
+        self.assertEqual(len(mail.outbox), sent + 2)
+        self.assertIs(utils.mail_connection(), connection)
+        message = mail.outbox[-1].message()
+        self.assertEqual(message.get_content_type(), 'multipart/related')
+        html, logo = message.get_payload()
+        self.assertEqual(html.get_content_type(), 'text/html')
+        self.assertEqual(logo['Content-ID'], '<sativa_logo>')
+        self.assertEqual(logo.get_payload(decode=True), utils.mail_logo())
+
+    def test_mail_templates_cached(self):
+        utils.load_mail_templates()
+        for name in utils.MAIL_TEMPLATES:
+            self.assertIs(
+                get_template(name).template, get_template(name).template
+            )
 
 
 class TestCustomerModel(TestSetUp):
@@ -396,18 +481,16 @@ class TestOrderModel(TestSetUp):
 
 class TestPaymentModel(TestSetUp):
     def test_create_payment(self):
-        transaction = 1
         amount = 34.9
         method = 'Debit Card'
         o = self.create_order()
         p = Payment.objects.create(
-            transaction=transaction,
             amount=amount,
             method=method,
             order=o,
         )
         self.assertTrue(Payment.objects.filter(id=p.id).exists())
-        self.assertEqual(p.transaction, transaction)
+        self.assertIsInstance(p.transaction, int)
         self.assertEqual(p.amount, amount)
         self.assertEqual(p.order, o)
         p.delete()
@@ -443,6 +526,41 @@ class TestPaymentModel(TestSetUp):
             Payment.objects.get(id=p.id)
         self.assertFalse(Payment.objects.filter(id=p.id).exists())
 
+    def test_concurrent_payment_transactions(self):
+        orders = [self.create_order() for _ in range(40)]
+
+        def create_payments(orders):
+            try:
+                for o in orders:
+                    Payment.objects.create(
+                        amount=10,
+                        method='Cash',
+                        order=o,
+                    )
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=create_payments, args=(orders[i::8], ))
+            for i in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        transactions = Payment.objects.values_list('transaction', flat=True)
+        self.assertEqual(len(transactions), 40)
+        self.assertEqual(len(set(transactions)), 40)
+
+    def test_bulk_create_payment_transactions(self):
+        payments = Payment.objects.bulk_create([
+            Payment(amount=10, method='Cash', order=self.create_order())
+            for _ in range(3)
+        ])
+        transactions = [p.transaction for p in payments]
+        self.assertEqual(len(set(transactions)), 3)
+        self.assertEqual(transactions, sorted(transactions))
+
 
 class TestQuotaModel(TestSetUp):
     def test_create_quota(self):
@@ -638,6 +756,71 @@ class TestCustomerView(TestSetUp):
             Customer.objects.get(id=c.id)
         self.assertFalse(Customer.objects.filter(id=c.id).exists())
 
+    def test_customer_balances(self):
+        o = self.create_order()
+        other = Customer.objects.create(
+            name='Nobody Owes',
+            address='Calle 1',
+            email='no@gmail.com',
+            cellphone='1',
+            type='Particular',
+        )
+        p = Payment.objects.create(amount=20, method='Cash', order=o)
+        for i, days in enumerate((-30, 30)):
+            Quota.objects.create(
+                current_quota=i + 1,
+                total_quota=2,
+                value=10,
+                date=date.today() + timedelta(days=days),
+                payment=p,
+            )
+        # the token's user, then the balances
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                self.customer_url + 'balances/',
+                format='json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        balances = {balance['pk']: balance for balance in response.data}
+        self.assertEqual(balances[o.customer_id], {
+            'pk': o.customer_id,
+            'name': 'Ken Koma',
+            'ordered': '47.20',
+            'paid': '20.00',
+            'due': '27.20',
+            'outstanding_quotas': '10.00',
+        })
+        self.assertEqual(balances[other.pk]['due'], '0.00')
+        with self.assertNumQueries(1):
+            self.client.get(
+                self.customer_url + 'balances/',
+                format='json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+            )
+
+        p.amount = 47.2
+        p.save()
+        # only the customer asked for is aggregated
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                self.customer_url + f'{o.customer_id}/balance/',
+                format='json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+            )
+        self.assertIn(
+            '"api_customer"."id" = %s' % o.customer_id,
+            queries[-1]['sql']
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['due'], '0.00')
+        response = self.client.get(
+            self.customer_url + '0/balance/',
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 
 class TestContainerView(TestSetUp):
     container_url = '/api/container/'
@@ -859,6 +1042,27 @@ class TestProductView(TestSetUp):
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_list_product_query_count(self):
+        self.create_product()
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(
+                self.product_url,
+                format='json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for _ in range(10):
+            self.create_product()
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(
+                self.product_url,
+                format='json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 11)
+        self.assertEqual(len(few), len(many))
+
     def test_create_product(self):
         c = Container.objects.create(
             type='Growler',
@@ -885,6 +1089,170 @@ class TestProductView(TestSetUp):
         )
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_bulk_create_product(self):
+        p = self.create_product()
+        payload = [
+            {
+                'code': str(700 + i),
+                'container': p.container.pk,
+                'flavour': p.flavour.pk,
+                'arrived_date': date.today(),
+                'price': 5.8,
+                'state': 'In Stock',
+            } for i in range(3)
+        ]
+        response = self.client.post(
+            self.product_url,
+            data=payload,
+            format='json',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [product['code'] for product in response.data],
+            ['700', '701', '702']
+        )
+        self.assertEqual(Product.objects.filter(code__gte='700').count(), 3)
+
+    def test_bulk_create_product_errors(self):
+        p = self.create_product()
+        payload = [
+            {
+                'code': '710',
+                'container': p.container.pk,
+                'flavour': p.flavour.pk,
+                'arrived_date': date.today(),
+                'price': 5.8,
+                'state': 'In Stock',
+            },
+            {
+                'code': '711',
+                'container': p.container.pk,
+                'flavour': p.flavour.pk,
+                'arrived_date': date.today(),
+                'price': 5.8,
+                'state': 'Lost',
+            },
+        ]
+        response = self.client.post(
+            self.product_url,
+            data=payload,
+            format='json',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('state', response.data[1])
+        self.assertFalse(Product.objects.filter(code='710').exists())
+
+    def test_bulk_update_product(self):
+        p = self.create_product()
+        p2 = self.create_product()
+        payload = [
+            {'pk': p.pk, 'state': 'Empty'},
+            {'pk': p2.pk, 'state': 'In Transit', 'price': 7.1},
+        ]
+        response = self.client.patch(
+            self.product_url + 'bulk_update/',
+            data=payload,
+            format='json',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        p.refresh_from_db()
+        p2.refresh_from_db()
+        self.assertEqual(p.state, 'Empty')
+        self.assertEqual(p2.state, 'In Transit')
+        self.assertEqual(float(p2.price), 7.1)
+        response = self.client.patch(
+            self.product_url + 'bulk_update/',
+            data=[{'pk': p.pk, 'state': 'In Stock'}, {'pk': 0}],
+            format='json',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('pk', response.data[1])
+
+    def test_list_product_filtered(self):
+        p = self.create_product()
+        other = self.create_product()
+        other.state = 'Empty'
+        other.save()
+        response = self.client.get(
+            self.product_url,
+            {'state': 'In Stock', 'flavour': p.flavour.pk, 'fields': 'code'},
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{'code': p.code}])
+
+    def test_list_product_not_modified(self):
+        p = self.create_product()
+        response = self.client.get(
+            self.product_url,
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                self.product_url,
+                format='json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}',
+                HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse(
+            [q for q in queries if 'api_product' in q['sql']]
+        )
+        # products are rendered with their flavour name
+        p.flavour.name = 'Camba'
+        p.flavour.save()
+        response = self.client.get(
+            self.product_url,
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}',
+            HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['flavour'], 'Camba')
+
+    def test_read_product_not_modified(self):
+        p = self.create_product()
+        other = self.create_product()
+        response = self.client.get(
+            self.product_url + f"{p.pk}/",
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        etag = response['ETag']
+        other.state = 'Empty'
+        other.save()
+        response = self.client.get(
+            self.product_url + f"{p.pk}/",
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}',
+            HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        p.state = 'Empty'
+        p.save()
+        response = self.client.get(
+            self.product_url + f"{p.pk}/",
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}',
+            HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['state'], 'Empty')
+
     def test_read_product(self):
         p = self.create_product()
         response = self.client.get(
@@ -965,6 +1333,140 @@ class TestProductView(TestSetUp):
             Product.objects.get(id=p.id)
         self.assertFalse(Product.objects.filter(id=p.id).exists())
 
+    def test_product_availability(self):
+        def counts():
+            return {
+                (c.flavour_id, c.container_id, c.state): c.count
+                for c in ProductCount.objects.filter(count__gt=0)
+            }
+
+        p = self.create_product()
+        p2 = Product.objects.create(
+            code='549',
+            container=p.container,
+            flavour=p.flavour,
+            arrived_date=date.today(),
+            price=6.80,
+            state='In Stock',
+        )
+        key = (p.flavour_id, p.container_id)
+        self.assertEqual(counts(), {key + ('In Stock', ): 2})
+        p2.state = 'In Transit'
+        p2.save()
+        self.assertEqual(
+            counts(),
+            {key + ('In Stock', ): 1, key + ('In Transit', ): 1}
+        )
+        response = self.client.patch(
+            self.product_url + 'bulk_update/',
+            data=[{'pk': p.pk, 'state': 'Empty'}] * 2,
+            format='json',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            counts(),
+            {key + ('Empty', ): 1, key + ('In Transit', ): 1}
+        )
+        p2.delete()
+        self.assertEqual(counts(), {key + ('Empty', ): 1})
+        response = self.client.get(
+            self.product_url + 'availability/',
+            {'state': 'Empty', 'flavour': p.flavour_id},
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0], {
+            'flavour': p.flavour_id,
+            'container': p.container_id,
+            'state': 'Empty',
+            'count': 1,
+        })
+        ProductCount.objects.update(count=7)
+        rebuild_product_counts()
+        self.assertEqual(counts(), {key + ('Empty', ): 1})
+
+    def test_product_counts_from_current_row(self):
+        p = self.create_product()
+        key = (p.flavour_id, p.container_id)
+        # a second copy of the product, loaded before the first one moves
+        stale = Product.objects.get(pk=p.pk)
+        p.state = 'In Transit'
+        p.save()
+        stale.state = 'Empty'
+        stale.save()
+        deferred = Product.objects.only('code').get(pk=p.pk)
+        deferred.code = '548'
+        deferred.save()
+        self.assertEqual(
+            dict(ProductCount.objects.filter(count__gt=0).values_list(
+                'state', 'count')),
+            {'Empty': 1}
+        )
+        order = self.create_order()
+        allocated = Product.objects.create(
+            code='549',
+            container=p.container,
+            flavour=p.flavour,
+            arrived_date=date.today(),
+            price=6.80,
+            state='In Stock',
+        )
+        loaded = Product.objects.get(pk=allocated.pk)
+        allocate_products(order, p.flavour, p.container, 1)
+        loaded.code = '550'
+        loaded.save(update_fields=['code'])
+        self.assertEqual(
+            dict(ProductCount.objects.filter(
+                flavour=key[0], container=key[1], count__gt=0
+            ).values_list('state', 'count')),
+            {'Empty': 1, 'In Transit': 1}
+        )
+
+    def test_concurrent_state_changes(self):
+        p = self.create_product()
+        products = [p] + [
+            Product.objects.create(
+                code=str(560 + i),
+                container=p.container,
+                flavour=p.flavour,
+                arrived_date=date.today(),
+                price=6.80,
+                state='In Stock' if i % 2 else 'In Transit',
+            )
+            for i in range(7)
+        ]
+        errors = []
+
+        def flip(product):
+            # moves between the same two counters in opposite directions
+            try:
+                for _ in range(10):
+                    product.state = 'In Transit' \
+                        if product.state == 'In Stock' else 'In Stock'
+                    product.save()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=flip, args=(product, ))
+            for product in products
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        counts = sorted(ProductCount.objects.filter(count__gt=0).values_list(
+            'flavour', 'container', 'state', 'count'))
+        rebuild_product_counts()
+        self.assertEqual(counts, sorted(ProductCount.objects.values_list(
+            'flavour', 'container', 'state', 'count')))
+
 
 class TestOrderView(TestSetUp):
     order_url = '/api/order/'
@@ -977,6 +1479,177 @@ class TestOrderView(TestSetUp):
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_list_order_query_count(self):
+        self.create_order()
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(
+                self.order_url,
+                format='json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for _ in range(10):
+            self.create_order()
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(
+                self.order_url,
+                format='json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 11)
+        self.assertEqual(response.data[0]['products'], ['548', '548'])
+        self.assertEqual(response.data[0]['customer'], 'Ken Koma')
+        self.assertEqual(len(few), len(many))
+
+    def test_list_order_paginated(self):
+        orders = [self.create_order() for _ in range(3)]
+        response = self.client.get(
+            self.order_url,
+            {'page_size': 2},
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [o['pk'] for o in response.data['results']],
+            [o.pk for o in orders[:2]]
+        )
+        self.assertIsNone(response.data['previous'])
+        # rows inserted between pages must not shift the cursor
+        new_order = self.create_order()
+        response = self.client.get(
+            response.data['next'],
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [o['pk'] for o in response.data['results']],
+            [orders[2].pk, new_order.pk]
+        )
+        self.assertIsNone(response.data['next'])
+
+    def test_list_order_filtered(self):
+        o = self.create_order()
+        old = self.create_order()
+        old.date = date.today() - timedelta(days=10)
+        old.state = 'Paid'
+        old.save()
+        response = self.client.get(
+            self.order_url,
+            {'date__gte': date.today() - timedelta(days=1)},
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([order['pk'] for order in response.data], [o.pk])
+        response = self.client.get(
+            self.order_url,
+            {'state': 'Paid', 'customer': old.customer.pk},
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual([order['pk'] for order in response.data], [old.pk])
+        response = self.client.get(
+            self.order_url,
+            {'date__gte': 'yesterday'},
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('date__gte', response.data)
+
+    def test_list_order_ordering(self):
+        o = self.create_order()
+        old = self.create_order()
+        old.date = date.today() - timedelta(days=10)
+        old.save()
+        response = self.client.get(
+            self.order_url,
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(
+            [order['pk'] for order in response.data],
+            [old.pk, o.pk]
+        )
+        response = self.client.get(
+            self.order_url,
+            {'ordering': '-date'},
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(
+            [order['pk'] for order in response.data],
+            [o.pk, old.pk]
+        )
+
+    def test_list_order_fields(self):
+        self.create_order()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                self.order_url,
+                {'fields': 'pk,date,customer'},
+                format='json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            list(response.data[0].keys()),
+            ['pk', 'date', 'customer']
+        )
+        self.assertEqual(response.data[0]['customer'], 'Ken Koma')
+        order_query = [
+            q['sql'] for q in queries if 'FROM "api_order"' in q['sql']
+        ][0]
+        self.assertNotIn('"api_order"."comment"', order_query)
+
+    def test_export_order_csv(self):
+        o = self.create_order()
+        old = self.create_order()
+        old.date = date.today() - timedelta(days=1)
+        old.save()
+        response = self.client.get(
+            self.order_url + 'export/',
+            {'date_from': date.today().strftime('%Y-%m-%d')},
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        rows = list(csv.reader(
+            StringIO(b''.join(response.streaming_content).decode())
+        ))
+        self.assertEqual(rows[0], list(utils.ORDER_COLUMNS))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][0], str(o.pk))
+        response = self.client.get(
+            self.order_url + 'export/',
+            {'date_from': 'yesterday'},
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_order_ndjson_gzip(self):
+        o = self.create_order()
+        response = self.client.get(
+            self.order_url + 'export/',
+            {'format': 'ndjson'},
+            HTTP_ACCEPT_ENCODING='gzip, deflate',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(
+            b''.join(response.streaming_content)
+        ).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0])
+        self.assertEqual(row['id'], o.pk)
+        self.assertEqual(row['total_amount'], '47.20')
+        self.assertEqual(row['customer'], o.customer_id)
+
     def test_create_order(self):
         c = Customer.objects.create(
             name='Michael Martin',
@@ -1099,6 +1772,100 @@ class TestOrderView(TestSetUp):
             Order.objects.get(id=o.id)
         self.assertFalse(Order.objects.filter(id=o.id).exists())
 
+    def create_kegs(self, number):
+        p = self.create_product()
+        for i in range(number - 1):
+            Product.objects.create(
+                code=str(600 + i),
+                container=p.container,
+                flavour=p.flavour,
+                arrived_date=date.today(),
+                price=6.80,
+                state='In Stock',
+            )
+        return p.flavour, p.container
+
+    def test_allocate_order(self):
+        o = self.create_order()
+        flavour, container = self.create_kegs(3)
+        payload = {'flavour': flavour.pk, 'container': container.pk}
+        response = self.client.post(
+            self.order_url + f"{o.pk}/allocate/",
+            data=dict(payload, quantity=2),
+            format='json',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        allocated = [p['pk'] for p in response.data['products']]
+        self.assertEqual(len(allocated), 2)
+        self.assertEqual(
+            set(o.products.filter(flavour=flavour).values_list(
+                'pk', flat=True)),
+            set(allocated)
+        )
+        self.assertEqual(
+            Product.objects.filter(
+                pk__in=allocated, state='In Transit').count(),
+            2
+        )
+        self.assertEqual(ProductCount.objects.get(
+            flavour=flavour, container=container, state='In Stock'
+        ).count, 1)
+        response = self.client.post(
+            self.order_url + f"{o.pk}/allocate/",
+            data=dict(payload, quantity=2),
+            format='json',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('quantity', response.data)
+        self.assertEqual(o.products.filter(flavour=flavour).count(), 2)
+
+    def test_concurrent_allocations(self):
+        flavour, container = self.create_kegs(20)
+        orders = [self.create_order() for _ in range(8)]
+        failures = []
+
+        def allocate(order):
+            try:
+                allocate_products(order, flavour, container, 3)
+            except ValidationError:
+                failures.append(order)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=allocate, args=(o, )) for o in orders
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        allocated = Order.products.through.objects.filter(
+            product__flavour=flavour
+        ).values_list('product_id', flat=True)
+        self.assertEqual(len(allocated), len(set(allocated)))
+        self.assertEqual(len(allocated), 3 * (len(orders) - len(failures)))
+        # 24 kegs are asked for, at most 18 of the 20 can be handed out
+        self.assertGreaterEqual(len(failures), 2)
+        for o in failures:
+            self.assertFalse(o.products.filter(flavour=flavour).exists())
+        self.assertEqual(
+            Product.objects.filter(
+                flavour=flavour, state='In Transit').count(),
+            len(allocated)
+        )
+        counts = list(ProductCount.objects.order_by('pk').values_list(
+            'flavour', 'container', 'state', 'count'))
+        rebuild_product_counts()
+        self.assertEqual(
+            sorted(c for c in counts if c[-1]),
+            sorted(ProductCount.objects.values_list(
+                'flavour', 'container', 'state', 'count'))
+        )
+
 
 class TestPaymentView(TestSetUp):
     payment_url = '/api/payment/'
@@ -1209,6 +1976,99 @@ class TestPaymentView(TestSetUp):
             Payment.objects.get(id=p.id)
         self.assertFalse(Payment.objects.filter(id=p.id).exists())
 
+    def test_payment_installments(self):
+        p = Payment.objects.create(
+            amount=100,
+            method='Credit Card',
+            order=self.create_order(),
+        )
+        Quota.objects.create(
+            current_quota=1,
+            total_quota=1,
+            value=100,
+            date=date.today(),
+            payment=p,
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                self.payment_url + f"{p.pk}/installments/",
+                data={
+                    'count': 3,
+                    'start_date': '2024-01-31',
+                    'period': 'month',
+                },
+                format='json',
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        inserts = [
+            q for q in queries
+            if q['sql'].startswith('INSERT INTO "api_quota"')
+        ]
+        self.assertEqual(len(inserts), 1)
+        quotas = Quota.objects.filter(payment=p).order_by('current_quota')
+        self.assertEqual(
+            [(q.current_quota, q.total_quota, q.value, q.date)
+             for q in quotas],
+            [
+                (1, 3, Decimal('33.34'), date(2024, 1, 31)),
+                (2, 3, Decimal('33.33'), date(2024, 2, 29)),
+                (3, 3, Decimal('33.33'), date(2024, 3, 31)),
+            ]
+        )
+        self.assertEqual(
+            [q['pk'] for q in response.data], [q.pk for q in quotas])
+        response = self.client.post(
+            self.payment_url + f"{p.pk}/installments/",
+            data={'count': 0, 'start_date': '2024-01-31', 'period': 'day'},
+            format='json',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data), {'count', 'period'})
+        for period in ('week', 'month'):
+            response = self.client.post(
+                self.payment_url + f"{p.pk}/installments/",
+                data={
+                    'count': 120,
+                    'start_date': '9999-01-31',
+                    'period': period,
+                },
+                format='json',
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+            )
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(set(response.data), {'start_date'})
+
+    def test_concurrent_payment_installments(self):
+        p = Payment.objects.create(
+            amount=100,
+            method='Credit Card',
+            order=self.create_order(),
+        )
+
+        def schedule():
+            try:
+                Payment.objects.get(pk=p.pk).schedule_quotas(
+                    4, date.today(), 'week')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=schedule) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(
+            list(Quota.objects.filter(payment=p).order_by(
+                'current_quota').values_list('current_quota', flat=True)),
+            [1, 2, 3, 4]
+        )
+
 
 class TestQuotaView(TestSetUp):
     quota_url = '/api/quota/'
@@ -1243,6 +2103,32 @@ class TestQuotaView(TestSetUp):
         )
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_bulk_create_quota(self):
+        p = Payment.objects.create(
+            amount=30,
+            method='Credit Card',
+            order=self.create_order(),
+        )
+        payload = [
+            {
+                'current_quota': i,
+                'total_quota': 3,
+                'value': 10,
+                'date': date.today() + timedelta(days=30 * i),
+                'payment': p.pk,
+            } for i in range(1, 4)
+        ]
+        response = self.client.post(
+            self.quota_url,
+            data=payload,
+            format='json',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(Quota.objects.filter(payment=p).count(), 3)
+
     def test_read_quota(self):
         p = Payment.objects.create(
             transaction=6,
@@ -1365,3 +2251,481 @@ class TestQuotaView(TestSetUp):
         with self.assertRaises(Quota.DoesNotExist):
             Quota.objects.get(id=q.id)
         self.assertFalse(Quota.objects.filter(id=q.id).exists())
+
+    def test_list_quota_paginated_ties(self):
+        p = Payment.objects.create(
+            amount=1500, method='Cash', order=self.create_order())
+        Quota.objects.bulk_create(
+            Quota(
+                current_quota=i + 1,
+                total_quota=1500,
+                value=1,
+                date=date.today(),
+                payment=p,
+            )
+            for i in range(1500)
+        )
+        seen = []
+        pages = []
+        url = self.quota_url + '?ordering=-value&page_size=600'
+        while url:
+            response = self.client.get(
+                url,
+                format='json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.data)
+            seen += [q['pk'] for q in response.data['results']]
+            url = response.data['next']
+        # 1500 rows share the ordering value, the third page starts past
+        # the 1000 rows DRF caps its cursor offset at
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(
+            seen,
+            sorted(Quota.objects.filter(payment=p).values_list(
+                'pk', flat=True))
+        )
+        response = self.client.get(
+            pages[2]['previous'],
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.data['results'], pages[1]['results'])
+        cursor = base64.b64encode(
+            urlencode({'p': json.dumps(['x', '1'])}).encode()).decode()
+        response = self.client.get(
+            self.quota_url,
+            {'ordering': 'value', 'cursor': cursor},
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_quotas_by_payment(self):
+        payments = [
+            Payment.objects.create(
+                amount=30,
+                method='Credit Card',
+                order=self.create_order(),
+            )
+            for _ in range(3)
+        ]
+        for p in payments[:2]:
+            p.schedule_quotas(3, date.today() - timedelta(weeks=1), 'week')
+        url = self.quota_url + 'by_payment/?payment=%s' % ','.join(
+            str(p.pk) for p in payments)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                url,
+                format='json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        quota_queries = [q for q in queries if 'api_quota' in q['sql']]
+        self.assertEqual(len(quota_queries), 1)
+        self.assertEqual(
+            [summary['payment'] for summary in response.data],
+            [p.pk for p in payments]
+        )
+        first = response.data[0]
+        self.assertEqual(
+            [q['current_quota'] for q in first['quotas']], [1, 2, 3])
+        self.assertEqual(first['paid'], Decimal(20))
+        self.assertEqual(first['remaining'], Decimal(10))
+        self.assertEqual(response.data[2]['quotas'], [])
+        with CaptureQueriesContext(connection) as cached:
+            response = self.client.get(
+                url,
+                format='json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+            )
+        self.assertFalse([q for q in cached if 'api_quota' in q['sql']])
+        response = self.client.get(
+            url,
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}',
+            HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        payments[2].schedule_quotas(1, tomorrow, 'month')
+        response = self.client.get(
+            url,
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.data[2]['remaining'], Decimal(30))
+        # the day changes in TIME_ZONE, whatever the date of the server
+        with mock.patch.object(
+                timezone, 'localdate', return_value=tomorrow):
+            response = self.client.get(
+                url,
+                format='json',
+                HTTP_AUTHORIZATION=f'Bearer {self.access_token}',
+                HTTP_IF_NONE_MATCH=response['ETag']
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[2]['paid'], Decimal(30))
+        response = self.client.get(
+            self.quota_url + 'by_payment/?payment=1,x',
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestReport(TestSetUp):
+    def test_generate_report(self):
+        o = self.create_order()
+        Payment.objects.create(
+            amount=47.2,
+            method='Cash',
+            order=o,
+        )
+        utils.generate_report({
+            'email': self.testing_payload['email'],
+            'username': self.testing_payload['username'],
+            'date_from': date.today().strftime('%Y-%m-%d'),
+        })
+        report_mail = mail.outbox[-1]
+        self.assertTrue(report_mail.subject.startswith('[Birracraft] Report'))
+        self.assertEqual(report_mail.to, [self.testing_payload['email']])
+        # the report is listed as an attachment, next to the html and the
+        # inline logo it shows
+        related, attachment = report_mail.message().get_payload()
+        self.assertEqual(
+            report_mail.message().get_content_type(), 'multipart/mixed')
+        self.assertEqual(related.get_content_type(), 'multipart/related')
+        self.assertEqual(attachment.get_content_disposition(), 'attachment')
+        _, content, _ = report_mail.attachments[-1]
+        wb = load_workbook(BytesIO(content))
+        self.assertEqual(
+            wb.sheetnames,
+            ['Totals', 'Orders', 'Payments', 'Products', 'Containers_Flavours']
+        )
+        totals = {
+            row[0]: row[1] for row in wb['Totals'].iter_rows(values_only=True)
+        }
+        self.assertEqual(totals['Orders'], 1)
+        self.assertEqual(totals['Payments'], 1)
+        self.assertEqual(totals['Products'], 2)
+        self.assertEqual(wb['Orders'].max_row, 2)
+        self.assertEqual(wb['Orders']['A2'].value, o.pk)
+        self.assertEqual(wb['Orders']['B2'].value.date(), o.date)
+        self.assertEqual(wb['Products'].max_row, 3)
+        self.assertEqual(wb['Containers_Flavours']['B2'].value, 'Growler')
+
+    def test_generate_report_workbook(self):
+        # the sheets of the parts are copied into the report as they are:
+        # their inline strings and date style must survive the merge
+        o = self.create_order()
+        p = Payment.objects.create(amount=47.2, method='Cash', order=o)
+        utils.generate_report({
+            'email': self.testing_payload['email'],
+            'username': self.testing_payload['username'],
+            'date_from': date.today().strftime('%Y-%m-%d'),
+        })
+        wb = load_workbook(BytesIO(mail.outbox[-1].attachments[-1][1]))
+        orders = list(wb['Orders'].iter_rows(min_row=2))
+        self.assertEqual(
+            [cell.value for cell in orders[0]][:5] + [orders[0][7].value],
+            [o.pk, datetime.combine(o.date, datetime.min.time()),
+             44.9, 2.3, 47.2, o.comment]
+        )
+        self.assertTrue(orders[0][1].is_date)
+        self.assertEqual(orders[0][1].number_format, 'yyyy-mm-dd')
+        payments = list(wb['Payments'].iter_rows(min_row=2, values_only=True))
+        self.assertEqual(payments[0][:4], (p.pk, p.transaction, 47.2, 'Cash'))
+        products = list(wb['Products'].iter_rows(min_row=2))
+        self.assertTrue(all(row[4].is_date for row in products))
+        self.assertEqual(products[0][1].value, '548')
+        self.assertEqual(wb['Totals']['A1'].value, 'Totals of all resources')
+        for ws in wb:
+            for row in ws.iter_rows():
+                for cell in row:
+                    if isinstance(cell.value, datetime):
+                        self.assertTrue(cell.is_date)
+
+    def test_generate_report_cached(self):
+        o = self.create_order()
+        data = {
+            'email': self.testing_payload['email'],
+            'username': self.testing_payload['username'],
+            'date_from': date.today().strftime('%Y-%m-%d'),
+        }
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                self.settings(REPORT_CACHE_DIR=cache_dir):
+            utils.generate_report(data)
+            utils.generate_report(data)
+            self.assertEqual(utils.report_stats(), {'hits': 1, 'misses': 1})
+            self.assertEqual(
+                mail.outbox[-1].attachments[-1][1],
+                mail.outbox[-2].attachments[-1][1]
+            )
+            o.state = 'Paid'
+            o.save()
+            utils.generate_report(data)
+            self.assertEqual(utils.report_stats(), {'hits': 1, 'misses': 2})
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            with self.settings(REPORT_CACHE_SIZE=1):
+                o.state = 'Pending'
+                o.save()
+                utils.generate_report(data)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+        response = self.client.get(
+            '/api/report/stats/',
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'hits': 1, 'misses': 3})
+
+    def test_report_parts_removed(self):
+        self.create_order()
+        data = {
+            'email': self.testing_payload['email'],
+            'username': self.testing_payload['username'],
+            'date_from': date.today().strftime('%Y-%m-%d'),
+            'report_run': 'run',
+        }
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                self.settings(REPORT_CACHE_DIR=cache_dir):
+            # only the path of a part goes through the result backend
+            path = utils.render_report_sheet(data, 'Orders')
+            self.assertEqual(os.listdir(cache_dir), ['run-Orders.part'])
+            self.assertEqual(path, os.path.join(cache_dir, 'run-Orders.part'))
+            utils.report_failed(None, ValueError(), None, data)
+            self.assertEqual(os.listdir(cache_dir), [])
+
+            stale = utils.render_report_sheet(data, 'Products')
+            os.utime(stale, (0, 0))
+            utils.store_report('new', b'new')
+            self.assertEqual(os.listdir(cache_dir), ['new.xlsx'])
+
+    def test_store_report_evicted_elsewhere(self):
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                self.settings(REPORT_CACHE_DIR=cache_dir, REPORT_CACHE_SIZE=1):
+            utils.store_report('old', b'old')
+            # another worker removes the files this one is evicting
+            with mock.patch.object(
+                    utils.os, 'remove', side_effect=FileNotFoundError):
+                utils.store_report('new', b'new')
+            utils.store_report('newer', b'newer')
+            self.assertEqual(os.listdir(cache_dir), ['newer.xlsx'])
+
+
+class TestCatalogs(TestSetUp):
+    def test_catalogs_cached(self):
+        p = self.create_product()
+        catalogs = get_catalogs()
+        self.assertEqual(catalogs['containers'][p.container_id], p.container)
+        self.assertEqual(catalogs['flavours'][p.flavour_id], p.flavour)
+        with self.assertNumQueries(0):
+            get_catalogs()
+
+    def test_catalogs_invalidated(self):
+        p = self.create_product()
+        get_catalogs()
+        f = p.flavour
+        f.name = 'Yarara'
+        f.save()
+        self.assertEqual(get_catalogs()['flavours'][f.pk].name, 'Yarara')
+        c = Container.objects.create(type='Keg', liters=50)
+        self.assertIn(c.pk, get_catalogs()['containers'])
+        c.delete()
+        self.assertNotIn(c.pk, get_catalogs()['containers'])
+
+
+class TestDailyTotals(TestSetUp):
+    def daily_totals(self):
+        return (
+            list(DailyOrderTotal.objects.order_by('date').values(
+                'date', 'orders', 'revenue'
+            )),
+            list(DailyShipmentTotal.objects.order_by(
+                'date', 'flavour', 'container'
+            ).values(
+                'date', 'flavour', 'container', 'kegs', 'liters'
+            )),
+            list(DailyPaymentTotal.objects.order_by('date').values(
+                'date', 'method', 'payments', 'amount'
+            )),
+        )
+
+    def test_daily_totals_maintained(self):
+        today = date.today()
+        o = self.create_order()
+        Payment.objects.create(amount=20, method='Cash', order=o)
+        orders, shipments, payments = self.daily_totals()
+        self.assertEqual(orders, [
+            {'date': today, 'orders': 1, 'revenue': Decimal('47.20')}
+        ])
+        self.assertEqual(len(shipments), 2)
+        self.assertEqual(
+            {(s['kegs'], s['liters']) for s in shipments},
+            {(1, Decimal('2.00'))}
+        )
+        self.assertEqual(payments, [
+            {
+                'date': today,
+                'method': 'Cash',
+                'payments': 1,
+                'amount': Decimal('20.00')
+            }
+        ])
+
+        o = Order.objects.get(pk=o.pk)
+        o.date = today - timedelta(days=1)
+        o.save()
+        orders, shipments, payments = self.daily_totals()
+        self.assertEqual([row['date'] for row in orders], [o.date])
+        self.assertEqual({row['date'] for row in shipments}, {o.date})
+        self.assertEqual([row['date'] for row in payments], [o.date])
+
+        o.products.first().delete()
+        self.assertEqual(len(self.daily_totals()[1]), 1)
+        o.delete()
+        self.assertEqual(self.daily_totals(), ([], [], []))
+
+    def test_daily_totals_from_current_row(self):
+        today = date.today()
+        o = self.create_order()
+        # a second copy of the order, loaded before the first one moves
+        stale = Order.objects.get(pk=o.pk)
+        o.date = today - timedelta(days=1)
+        o.save()
+        stale.date = today + timedelta(days=1)
+        stale.save()
+        self.assertEqual(
+            [row['date'] for row in self.daily_totals()[0]], [stale.date]
+        )
+
+    def test_daily_totals_bulk_update(self):
+        o = self.create_order()
+        keg = Container.objects.create(type='Keg', liters=50)
+        response = self.client.patch(
+            '/api/product/bulk_update/',
+            data=[{'pk': p.pk, 'container': keg.pk} for p in o.products.all()],
+            format='json',
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        shipments = self.daily_totals()[1]
+        self.assertEqual({s['container'] for s in shipments}, {keg.pk})
+        self.assertEqual(sum(s['liters'] for s in shipments), 100)
+
+    def test_daily_totals_rebuilt(self):
+        o = self.create_order()
+        Payment.objects.create(amount=20, method='Cash', order=o)
+        maintained = self.daily_totals()
+        # writes that skip signals are only picked up by a rebuild
+        Order.objects.filter(pk=o.pk).update(total_amount=50)
+        refresh_daily_totals()
+        orders, shipments, payments = self.daily_totals()
+        self.assertEqual(orders[0]['revenue'], Decimal('50.00'))
+        self.assertEqual((shipments, payments), maintained[1:])
+        response = self.client.get(
+            '/api/report/daily/',
+            {'date_from': date.today().strftime('%Y-%m-%d')},
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['orders']), 1)
+        self.assertEqual(len(response.data['shipments']), 2)
+        self.assertEqual(len(response.data['payments']), 1)
+
+    def test_daily_totals_rebuilt_in_batches(self):
+        self.create_order()
+        o2 = self.create_order()
+        Order.objects.filter(pk=o2.pk).update(
+            date=date.today() - timedelta(days=1))
+        DailyOrderTotal.objects.create(
+            date=date.today() - timedelta(days=2), orders=1, revenue=1)
+        self.addCleanup(setattr, aggregates, 'REBUILD_BATCH',
+                        aggregates.REBUILD_BATCH)
+        aggregates.REBUILD_BATCH = 1
+        refresh_daily_totals()
+        self.assertEqual(
+            list(DailyOrderTotal.objects.order_by('date').values_list(
+                'date', 'orders')),
+            [(date.today() - timedelta(days=1), 1), (date.today(), 1)]
+        )
+
+
+class TestConnections(TestSetUp):
+    def test_dropped_connection_replaced(self):
+        self.assertTrue(connection.settings_dict['CONN_HEALTH_CHECKS'])
+        connection.ensure_connection()
+        # as when the server closes an idle persistent connection
+        connection.connection.close()
+        response = self.client.get(
+            '/api/customer/',
+            format='json',
+            HTTP_AUTHORIZATION=f'Bearer {self.access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class TestAsyncViews(TestSetUp):
+    def test_async_view(self):
+        # pool threads close their connections after each request, or they
+        # would hold the test database open
+        settings_dict = connection.settings_dict
+        self.addCleanup(
+            settings_dict.__setitem__,
+            'CONN_MAX_AGE',
+            settings_dict['CONN_MAX_AGE']
+        )
+        settings_dict['CONN_MAX_AGE'] = 0
+        o = self.create_order()
+        view = views.async_view(
+            views.OrderViewSet.as_view({'get': 'list'})
+        )
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+
+        async def list_orders():
+            return await asyncio.gather(*(
+                view(AsyncRequestFactory().get(
+                    '/api/order/',
+                    authorization=f'Bearer {self.access_token}'
+                ))
+                for _ in range(4)
+            ))
+
+        for response in async_to_sync(list_orders)():
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                json.loads(response.content)[0]['pk'], o.pk
+            )
+
+    def test_asgi_export(self):
+        # Django 4.0 iterates streaming responses on the event loop
+        from birracraft.asgi import application
+        p = self.create_product()
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        async_to_sync(application)({
+            'type': 'http',
+            'method': 'GET',
+            'path': '/api/product/export/',
+            'query_string': b'',
+            'headers': [
+                (b'host', b'localhost'),
+                (b'authorization', f'Bearer {self.access_token}'.encode()),
+            ],
+        }, receive, send)
+        self.assertEqual(messages[0]['status'], status.HTTP_200_OK)
+        rows = list(csv.reader(StringIO(b''.join(
+            m.get('body', b'') for m in messages[1:]
+        ).decode())))
+        self.assertEqual(rows[0], list(utils.PRODUCT_COLUMNS))
+        self.assertEqual(rows[1][0], str(p.pk))
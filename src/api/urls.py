@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.documentation import include_docs_urls
 from rest_framework.permissions import AllowAny
@@ -48,5 +49,42 @@ urlpatterns = [
         views.reset_password,
         name='reset_password'
     ),
+]
+
+# Under ASGI the hottest endpoints run on the thread pool instead of the
+# single thread every sync view of a worker shares
+if settings.SERVER_MODE == 'asgi':
+    urlpatterns += [
+        path(
+            'order/',
+            views.async_view(views.OrderViewSet.as_view(
+                {'get': 'list', 'post': 'create'}
+            )),
+            name='order-list-async'
+        ),
+        path(
+            'product/',
+            views.async_view(views.ProductViewSet.as_view(
+                {'get': 'list', 'post': 'create'}
+            )),
+            name='product-list-async'
+        ),
+        path(
+            'quota/list_by_payment/',
+            views.async_view(views.QuotaViewSet.as_view(
+                {'post': 'list_by_payment'}
+            )),
+            name='quota-list-by-payment-async'
+        ),
+        path(
+            'quota/by_payment/',
+            views.async_view(views.QuotaViewSet.as_view(
+                {'get': 'by_payment'}
+            )),
+            name='quota-by-payment-async'
+        ),
+    ]
+
+urlpatterns += [
     path('', include((router.urls, 'Birracraft'), namespace='Birracraft')),
 ]
@@ -1,52 +1,240 @@
 from django.conf import settings
-from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.core.mail.message import SafeMIMEMultipart
+from django.template.loader import get_template
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.utils import six
 from birracraft.celery import app
-from api.models import Order, Payment, Quota, Product, Container, Flavour
+from celery import chord
+from celery.signals import worker_process_init, worker_process_shutdown
+from celery.utils.log import get_task_logger
+from django.db.models import Sum
+from api.models import (
+    Order,
+    Payment,
+    Quota,
+    Product,
+    Container,
+    Flavour,
+    DailyOrderTotal,
+    DailyPaymentTotal
+)
+from api.aggregates import refresh_daily_totals
+from api.catalogs import get_catalogs
+from api.versions import get_versions
 from openpyxl import Workbook
-from openpyxl.writer.excel import save_virtual_workbook
-from datetime import datetime
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import NamedStyle
+from datetime import date, datetime
+from email.mime.image import MIMEImage
+import functools
+import hashlib
+import os
+import shutil
+import smtplib
+import tempfile
+import time
+import uuid
+import zipfile
+
+logger = get_task_logger(__name__)
+
+REPORT_CHUNK_SIZE = 2000
+
+MAIL_TEMPLATES = (
+    'report_mail.html',
+    'reset_pass_mail.html',
+    'validate_user_mail.html',
+)
+RESOURCES_DIR = os.path.join(os.path.dirname(__file__), 'resources')
+LOGO_FILE = 'sativa_logo.jpeg'
+
+# SMTP connection of this process, see mail_connection
+_mail_connection = None
+
+# in the order they appear in the workbook, after Totals
+REPORT_SHEETS = ('Orders', 'Payments', 'Products', 'Containers_Flavours')
+
+# (name, number format) of the only cell styles report sheets use, see
+# report_workbook
+REPORT_STYLES = (
+    ('report_date', 'yyyy-mm-dd'),
+)
+
+ORDER_COLUMNS = (
+    'id',
+    'date',
+    'price',
+    'delivery_cost',
+    'total_amount',
+    'customer',
+    'state',
+    'comment',
+)
+PAYMENT_COLUMNS = ('id', 'transaction', 'amount', 'method', 'order')
+QUOTA_COLUMNS = (
+    'id',
+    'current_quota',
+    'total_quota',
+    'value',
+    'date',
+    'payment',
+)
+PRODUCT_COLUMNS = (
+    'id',
+    'code',
+    'container',
+    'flavour',
+    'arrived_date',
+    'price',
+    'state',
+)
 
 
 def send_reset_pass_mail(request, user):
-    msg = render_to_string('../templates/reset_pass_mail.html', {
-        'username': user.username,
-        'protocol': request.scheme,
-        'domain': request.get_host(),
-        'uid': urlsafe_base64_encode(force_bytes(user.pk)),
-        'token': account_activation_token.make_token(user),
-        })
-    confirm_email = EmailMessage(
-        subject='Password reset on Birracraft',
-        body=msg,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[request.data['email']],
-    )
-    confirm_email.content_subtype = 'html'
-    confirm_email.send()
+    send_mails.delay([{
+        'template': 'reset_pass_mail.html',
+        'context': {
+            'username': user.username,
+            'protocol': request.scheme,
+            'domain': request.get_host(),
+            'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+            'token': account_activation_token.make_token(user),
+        },
+        'subject': 'Password reset on Birracraft',
+        'to': [request.data['email']],
+    }])
 
 
 def send_verification_mail(request):
     user_email = request.data['email']
-    msg = render_to_string('../templates/validate_user_mail.html', {
-        'username': request.data['username'],
-        'protocol': request.scheme,
-        'domain': request.get_host(),
-        'uid': urlsafe_base64_encode(force_bytes(user_email)),
-        'token': account_activation_token.make_token(user_email),
-        })
-    confirm_email = EmailMessage(
-        subject='Verificate your user account created on Birracraft',
-        body=msg,
+    send_mails.delay([{
+        'template': 'validate_user_mail.html',
+        'context': {
+            'username': request.data['username'],
+            'protocol': request.scheme,
+            'domain': request.get_host(),
+            'uid': urlsafe_base64_encode(force_bytes(user_email)),
+            'token': account_activation_token.make_token(user_email),
+        },
+        'subject': 'Verificate your user account created on Birracraft',
+        'to': [request.data['email']],
+    }])
+
+
+@app.task(
+    autoretry_for=(smtplib.SMTPException, OSError),
+    retry_backoff=True,
+    retry_backoff_max=10 * 60,
+    max_retries=5,
+)
+def send_mails(messages):
+    """
+    Render and send `messages`, dicts with the `template`, `context`,
+    `subject` and `to` of each mail, over this worker's mail connection.
+    Failed batches are retried with exponential backoff.
+    """
+    emails = [
+        mail_message(
+            message['template'],
+            message['context'],
+            subject=message['subject'],
+            to=message['to'],
+        )
+        for message in messages
+    ]
+    try:
+        mail_connection().send_messages(emails)
+    except (smtplib.SMTPException, OSError):
+        # the retry opens a new connection
+        close_mail_connection()
+        raise
+
+
+class RelatedEmailMessage(EmailMessage):
+    """
+    EmailMessage whose body is sent in a multipart/related part along with
+    the `related` parts it refers to, e.g. inline images. Attachments stay
+    next to that part in the top multipart/mixed, where clients list them.
+    """
+
+    def __init__(self, *args, related=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.related = list(related)
+
+    def _create_message(self, msg):
+        if self.related:
+            body = msg
+            msg = SafeMIMEMultipart(_subtype='related', encoding=self.encoding)
+            msg.attach(body)
+            for part in self.related:
+                msg.attach(part)
+        return super()._create_message(msg)
+
+
+def mail_message(template, context, **kwargs):
+    """
+    Return an html RelatedEmailMessage with `template` rendered as its
+    body and the logo the mail templates show as an inline image.
+    """
+    logo = MIMEImage(mail_logo(), 'jpeg')
+    logo.add_header('Content-ID', '<sativa_logo>')
+    logo.add_header('Content-Disposition', 'inline', filename=LOGO_FILE)
+    email = RelatedEmailMessage(
+        body=get_template(template).render(context),
         from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[request.data['email']],
+        related=[logo],
+        **kwargs
     )
-    confirm_email.content_subtype = 'html'
-    confirm_email.send()
+    email.content_subtype = 'html'
+    return email
+
+
+@functools.lru_cache(maxsize=None)
+def mail_logo():
+    with open(os.path.join(RESOURCES_DIR, LOGO_FILE), 'rb') as f:
+        return f.read()
+
+
+@worker_process_init.connect
+def load_mail_templates(**kwargs):
+    # parse every mail template and read the logo before the first task
+    for template in MAIL_TEMPLATES:
+        get_template(template)
+    mail_logo()
+
+
+def mail_connection():
+    """
+    Return the mail connection of this process, opened on first use and
+    kept open between batches. A connection the server dropped while idle
+    is replaced.
+    """
+    global _mail_connection
+    smtp = getattr(_mail_connection, 'connection', None)
+    if smtp is not None:
+        try:
+            smtp.noop()
+        except (smtplib.SMTPException, OSError):
+            close_mail_connection()
+    if _mail_connection is None:
+        _mail_connection = get_connection()
+        _mail_connection.open()
+    return _mail_connection
+
+
+@worker_process_shutdown.connect
+def close_mail_connection(**kwargs):
+    global _mail_connection
+    if _mail_connection is not None:
+        try:
+            _mail_connection.close()
+        except (smtplib.SMTPException, OSError):
+            pass
+        _mail_connection = None
 
 
 class TokenGenerator(PasswordResetTokenGenerator):
@@ -61,29 +249,69 @@ account_activation_token = TokenGenerator()
 
 @app.task
 def generate_report(data):
+    # Reports are cached by date_from and the version of every table they
+    # read, so a repeated request only sends the mail again
+    versions = get_versions(Order, Payment, Quota, Product, Container, Flavour)
+    key = hashlib.sha256('|'.join(
+        [data['date_from']] + [version.isoformat() for version in versions]
+    ).encode()).hexdigest()
+    path = cached_report(key)
+    if path is not None:
+        count_report('hits')
+        with open(path, 'rb') as report_file:
+            send_report_mail(data, report_file.read())
+        return
+    count_report('misses')
+
+    # Each sheet is rendered by its own subtask into a one-sheet part;
+    # merge_report copies the parts into the final workbook once all of
+    # them are done, so the report takes as long as its largest sheet.
+    # Parts are files in the report cache dir, only their paths travel
+    # through the result backend.
+    data = dict(data, report_key=key, report_run=uuid.uuid4().hex)
+    chord(
+        render_report_sheet.s(data, sheet) for sheet in REPORT_SHEETS
+    )(merge_report.s(data).on_error(report_failed.s(data)))
 
-    # Get data
-    orders = Order.objects.filter(
-        date__gte=data['date_from']).values_list()
-    orders_list = [order for order in orders]
 
-    payments = Payment.objects.all().values_list()
-    payments_list = [pay for pay in payments]
-    quotas = Quota.objects.all().values_list()
-    quotas_list = [quota for quota in quotas]
+@app.task
+def render_report_sheet(data, sheet):
+    # A write-only workbook flushes each row to disk as it is appended, so
+    # memory stays bounded no matter how many rows the querysets stream.
+    wb = report_workbook()
+    if sheet == 'Orders':
+        treat_orders(wb, stream(Order.objects.filter(
+            date__gte=data['date_from']).values_list(*ORDER_COLUMNS)))
+    elif sheet == 'Payments':
+        treat_payments(
+            wb,
+            stream(Payment.objects.all().values_list(*PAYMENT_COLUMNS)),
+            stream(Quota.objects.all().values_list(*QUOTA_COLUMNS))
+        )
+    elif sheet == 'Products':
+        treat_products(
+            wb, stream(Product.objects.all().values_list(*PRODUCT_COLUMNS)))
+    elif sheet == 'Containers_Flavours':
+        catalogs = get_catalogs()
+        treat_containers_flavours(
+            wb,
+            [(c.pk, c.type, c.liters)
+             for c in catalogs['containers'].values()],
+            [(f.pk, f.name, f.description, f.price_per_lt)
+             for f in catalogs['flavours'].values()]
+        )
+    path = report_part_path(data, sheet)
+    write_report_file(path, wb.save)
+    return path
 
-    products = Product.objects.all().values_list()
-    products_list = [product for product in products]
 
-    containers = Container.objects.all().values_list()
-    containers_list = [container for container in containers]
-    flavours = Flavour.objects.all().values_list()
-    flavours_list = [flavour for flavour in flavours]
+@app.task
+def merge_report(parts, data):
+    catalogs = get_catalogs()
 
     # Make report
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Totals'
+    wb = report_workbook()
+    ws = wb.create_sheet('Totals')
 
     ws.append(['Totals of all resources'])
     ws.append([])
@@ -94,54 +322,110 @@ def generate_report(data):
     ])
     ws.append([
         'Orders',
-        len(orders_list)
+        DailyOrderTotal.objects.filter(
+            date__gte=data['date_from']
+        ).aggregate(total=Sum('orders'))['total'] or 0
     ])
     ws.append([
         'Payments',
-        len(payments_list),
+        DailyPaymentTotal.objects.aggregate(
+            total=Sum('payments')
+        )['total'] or 0,
     ])
     ws.append([
         'Quotas',
-        len(quotas_list),
+        Quota.objects.count(),
     ])
     ws.append([])
     ws.append([
         'Products',
-        len(products_list)
+        Product.objects.count()
     ])
     ws.append([
         'Containers',
-        len(containers_list)
+        len(catalogs['containers'])
     ])
     ws.append([
         'Flavours',
-        len(flavours_list)
+        len(catalogs['flavours'])
     ])
 
-    wb = treat_orders(wb, orders_list)
-    wb = treat_payments(wb, payments_list, quotas_list)
-    wb = treat_products(wb, products_list)
-    wb = treat_containers_flavours(wb, containers_list, flavours_list)
+    # Placeholders for the parts, whose sheets replace them as they are
+    for sheet in REPORT_SHEETS:
+        wb.create_sheet(sheet)
+
+    # worksheets are numbered in creation order, Totals being sheet1
+    parts = {
+        'xl/worksheets/sheet%s.xml' % (i + 2): part
+        for i, part in enumerate(parts)
+    }
+    try:
+        with tempfile.TemporaryDirectory(prefix='report-') as report_dir:
+            skeleton = os.path.join(report_dir, 'report.xlsx')
+            wb.save(skeleton)
+            report_path = os.path.join(report_dir, 'merged.xlsx')
+            with open(report_path, 'w+b') as report_file:
+                with zipfile.ZipFile(skeleton) as src, zipfile.ZipFile(
+                        report_file, 'w', zipfile.ZIP_DEFLATED) as dst:
+                    styles = src.read('xl/styles.xml')
+                    for item in src.infolist():
+                        if item.filename not in parts:
+                            dst.writestr(item, src.read(item.filename))
+                            continue
+                        with zipfile.ZipFile(parts[item.filename]) as part:
+                            # style indexes are copied along with the cells
+                            if part.read('xl/styles.xml') != styles:
+                                raise ValueError(
+                                    'Report part %s has other styles'
+                                    % item.filename
+                                )
+                            with part.open('xl/worksheets/sheet1.xml') \
+                                    as sheet_xml, \
+                                    dst.open(item.filename, 'w',
+                                             force_zip64=True) as merged_xml:
+                                shutil.copyfileobj(sheet_xml, merged_xml)
+                report_file.seek(0)
+                excel = report_file.read()
+    finally:
+        remove_report_parts(data)
+
+    send_report_mail(data, excel)
+    store_report(data['report_key'], excel)
 
-    excel = save_virtual_workbook(wb)
 
+@app.task
+def report_failed(request, exc, traceback, data):
+    # parts of sheets still rendering are written after this, eviction
+    # removes them once they are stale
+    remove_report_parts(data)
+    logger.error(
+        'Report since %s for %s failed: %r',
+        data['date_from'], data['email'], exc
+    )
+
+
+@app.task
+def rebuild_daily_totals():
+    # writes saved without signals (bulk endpoints, raw SQL) are only picked
+    # up here
+    refresh_daily_totals()
+
+
+def send_report_mail(data, excel):
     # Set email
     title = '[Birracraft] Report with data since {0} to {1}'.format(
                 data['date_from'],
                 datetime.today().strftime('%Y-%m-%d'))
 
-    msg = render_to_string('../templates/report_mail.html', {
-        'date_from': data['date_from'],
-        'username': data['username'],
-        })
-
-    email = EmailMessage(
+    email = mail_message(
+        'report_mail.html',
+        {
+            'date_from': data['date_from'],
+            'username': data['username'],
+        },
         subject=title,
-        body=msg,
-        from_email=settings.DEFAULT_FROM_EMAIL,
         to=[data['email']]
     )
-    email.content_subtype = 'html'
     email.attach(
         'Birracraft_Report_{0}.xlsx'.format(
             datetime.today().strftime('%Y-%m-%d')
@@ -150,7 +434,131 @@ def generate_report(data):
         'application/vnd.openxmlformats-officedocument\
         .spreadsheetml.sheet'
     )
-    email.send()
+    mail_connection().send_messages([email])
+
+
+def stream(queryset):
+    return queryset.iterator(chunk_size=REPORT_CHUNK_SIZE)
+
+
+def report_workbook():
+    """
+    Return a write-only workbook registering REPORT_STYLES before any
+    cell: a style then has the same index in every report workbook, so
+    the cells of a part keep their style once copied into the report.
+    """
+    wb = Workbook(write_only=True)
+    for name, number_format in REPORT_STYLES:
+        style = NamedStyle(name, number_format=number_format)
+        wb.add_named_style(style)
+        wb._cell_styles.add(style.as_tuple())
+    return wb
+
+
+def report_row(ws, row):
+    # dates take the registered style instead of one openpyxl would add on
+    # first use
+    cells = list(row)
+    for i, value in enumerate(cells):
+        if isinstance(value, date):
+            cells[i] = WriteOnlyCell(ws, value)
+            cells[i].style = 'report_date'
+    return cells
+
+
+def report_part_path(data, sheet):
+    return os.path.join(
+        settings.REPORT_CACHE_DIR,
+        '%s-%s.part' % (data['report_run'], sheet)
+    )
+
+
+def remove_report_parts(data):
+    for sheet in REPORT_SHEETS:
+        try:
+            os.remove(report_part_path(data, sheet))
+        except FileNotFoundError:
+            pass
+
+
+def cached_report(key):
+    path = os.path.join(settings.REPORT_CACHE_DIR, '%s.xlsx' % key)
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except FileNotFoundError:
+        return None
+    if age > settings.REPORT_CACHE_TTL:
+        return None
+    # the modification time doubles as the last use for LRU eviction
+    os.utime(path)
+    return path
+
+
+def write_report_file(path, write):
+    """
+    Write the report cache file `path` with `write(report_file)`. It is
+    written to a file of its own and renamed into place once complete:
+    workers writing the same file never write over each other, and readers
+    never see a partially written one.
+    """
+    os.makedirs(settings.REPORT_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=settings.REPORT_CACHE_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as report_file:
+            write(report_file)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def store_report(key, excel):
+    write_report_file(
+        os.path.join(settings.REPORT_CACHE_DIR, '%s.xlsx' % key),
+        lambda report_file: report_file.write(excel)
+    )
+    evict_reports()
+
+
+def evict_reports():
+    reports = []
+    for entry in os.scandir(settings.REPORT_CACHE_DIR):
+        # another worker may be evicting the same files
+        try:
+            mtime = entry.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        if entry.name.endswith('.xlsx'):
+            reports.append((mtime, entry.path))
+        elif entry.name.endswith('.part') and \
+                time.time() - mtime > settings.REPORT_CACHE_TTL:
+            # left by a failed report, see report_failed
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+    reports.sort(reverse=True)
+    for i, (mtime, path) in enumerate(reports):
+        if i >= settings.REPORT_CACHE_SIZE or \
+                time.time() - mtime > settings.REPORT_CACHE_TTL:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def count_report(counter):
+    key = 'reports:%s' % counter
+    cache.add(key, 0, timeout=None)
+    cache.incr(key)
+
+
+def report_stats():
+    stats = cache.get_many(['reports:hits', 'reports:misses'])
+    return {
+        'hits': stats.get('reports:hits', 0),
+        'misses': stats.get('reports:misses', 0),
+    }
 
 
 def treat_orders(wb, orders):
@@ -168,7 +576,7 @@ def treat_orders(wb, orders):
     ])
 
     for order in orders:
-        ws_orders.append(order)
+        ws_orders.append(report_row(ws_orders, order))
 
     return wb
 
@@ -200,7 +608,7 @@ def treat_payments(wb, payments, quotas):
     ])
 
     for quota in quotas:
-        ws_payments.append(quota)
+        ws_payments.append(report_row(ws_payments, quota))
 
     return wb
 
@@ -218,7 +626,7 @@ def treat_products(wb, products):
     ])
 
     for product in products:
-        ws_products.append(product)
+        ws_products.append(report_row(ws_products, product))
 
     return wb
 
@@ -0,0 +1,33 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+
+def _key(model):
+    return 'version:%s' % model._meta.label_lower
+
+
+def get_versions(*models):
+    """
+    Return, for each model, the time its table was last written as recorded
+    by `touch`. Tables with no record yet get the current time, so clients
+    revalidate instead of trusting an unknown state.
+    """
+    keys = [_key(model) for model in models]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        now = timezone.now()
+        for key in missing:
+            cache.add(key, now, timeout=None)
+        versions.update(cache.get_many(missing))
+    return [versions[key] for key in keys]
+
+
+def touch(*models):
+    # record the write once it is visible to other processes, so none of
+    # them can pair the new version with the data as it was before it
+    def record():
+        now = timezone.now()
+        cache.set_many({_key(model): now for model in models}, timeout=None)
+    transaction.on_commit(record)
@@ -1,11 +1,19 @@
 from django.contrib.auth.models import User
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils.http import urlsafe_base64_decode
 from django.utils.encoding import force_str
 from django.shortcuts import redirect
+from django.middleware.gzip import re_accepts_gzip
+from django.utils.cache import patch_vary_headers
+from django.utils import timezone
+from django.utils.text import compress_sequence
+from django.views.decorators.http import condition
 from django.core import serializers as s
+from django.db import close_old_connections
+from django.db.models import Prefetch
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 from api.models import (
     Customer,
@@ -14,11 +22,28 @@ from api.models import (
     Product,
     Order,
     Payment,
-    Quota
+    Quota,
+    ProductCount,
+    DailyOrderTotal,
+    DailyShipmentTotal,
+    DailyPaymentTotal
 )
 from api import serializers, utils
+from api.balances import get_balances, get_payment_quotas
+from api.filters import QueryParamFilter
+from api.inventory import allocate_products
+from api.renderers import CSVRenderer, NDJSONRenderer
+from api.signals import check_connections
+from api.versions import get_versions
+from asgiref.sync import sync_to_async
+from datetime import datetime, time
+import functools
+import hashlib
 import json
 
+# payments a single quotas lookup may ask for
+MAX_PAYMENTS = 100
+
 
 def activate_user(request, uidb64, token):
     protocol = request.scheme + '://'
@@ -54,6 +79,179 @@ def reset_password(request, uidb64, token):
     return redirect(site)
 
 
+def async_view(view):
+    """
+    Wraps a sync view in a coroutine that runs it, rendering included, on
+    the default thread pool, so an ASGI worker keeps serving other requests
+    while it waits on the database (Django 4.0 has no async ORM).
+    """
+    def run(request, *args, **kwargs):
+        # pool threads hold their own connections, the request signals of
+        # the ASGI handler only look after its own thread's
+        close_old_connections()
+        check_connections()
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+        finally:
+            close_old_connections()
+    run = sync_to_async(run, thread_sensitive=False)
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await run(request, *args, **kwargs)
+    return wrapper
+
+
+class BulkCreateUpdateMixin:
+    """
+    Lets `create` take a list payload and adds a `bulk_update` action
+    taking a list of items with their `pk`. Both are saved with a single
+    bulk query and report validation errors by item index.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        if isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+        return super().get_serializer(*args, **kwargs)
+
+    @action(methods=('put', 'patch'), detail=False)
+    def bulk_update(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            raise ValidationError(
+                {'non_field_errors': ['Expected a list of items.']}
+            )
+        pks = [
+            item.get('pk') if isinstance(item, dict) else None
+            for item in request.data
+        ]
+        found = self.get_queryset().in_bulk(
+            [pk for pk in pks if isinstance(pk, int)]
+        )
+        errors = [{} if pk in found else {'pk': ['Not found.']} for pk in pks]
+        if any(errors):
+            raise ValidationError(errors)
+        serializer = self.get_serializer(
+            [found[pk] for pk in pks],
+            data=request.data,
+            partial=request.method == 'PATCH'
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
+
+class ExportMixin:
+    """
+    Adds an `export` action streaming the `export_columns` of every row as
+    CSV (`?format=csv`, the default) or NDJSON (`?format=ndjson`), gzipped
+    when the client accepts it. The view's filters apply, and `date_from`
+    filters on `export_date_field` as in reports.
+    """
+    export_columns = ()
+    export_date_field = None
+
+    @action(
+        methods=('get', ),
+        detail=False,
+        renderer_classes=(CSVRenderer, NDJSONRenderer)
+    )
+    def export(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if 'date_from' in request.query_params and self.export_date_field:
+            serializer = serializers.ReportSerializer(
+                data=request.query_params
+            )
+            serializer.is_valid(raise_exception=True)
+            queryset = queryset.filter(**{
+                self.export_date_field + '__gte':
+                    serializer.validated_data['date_from']
+            })
+        rows = queryset.prefetch_related(None).values_list(
+            *self.export_columns
+        ).iterator(chunk_size=utils.REPORT_CHUNK_SIZE)
+        renderer = request.accepted_renderer
+        content = renderer.stream(self.export_columns, rows)
+        gzipped = re_accepts_gzip.search(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+        if gzipped:
+            content = compress_sequence(content)
+        response = StreamingHttpResponse(
+            content,
+            content_type='%s; charset=%s' % (
+                renderer.media_type, renderer.charset
+            )
+        )
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (
+            queryset.model._meta.model_name, renderer.format
+        )
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ('Accept-Encoding', ))
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag and Last-Modified to list and retrieve responses and answers
+    304 when the client's copy is current, before querying or serializing.
+    Validators come from the table versions of the model and of the
+    `version_models` its representation is built from; a single object
+    uses its own `updated_at` instead of its table version. Responses of
+    the `daily_actions` also change with the date, so the start of the day
+    is one of their validators.
+    """
+    version_models = ()
+    daily_actions = ()
+
+    def get_validators(self, request, *args, **kwargs):
+        if not hasattr(self, '_validators'):
+            model = self.get_queryset().model
+            if self.action == 'retrieve':
+                lookup = self.lookup_url_kwarg or self.lookup_field
+                try:
+                    stamps = list(model._default_manager.filter(
+                        **{self.lookup_field: kwargs[lookup]}
+                    ).values_list('updated_at', flat=True))
+                except (TypeError, ValueError):
+                    stamps = []
+                if stamps:
+                    stamps += get_versions(*self.version_models)
+            else:
+                stamps = get_versions(model, *self.version_models)
+            if stamps and self.action in self.daily_actions:
+                # the day in TIME_ZONE, as get_payment_quotas splits it
+                stamps.append(timezone.make_aware(
+                    datetime.combine(timezone.localdate(), time.min)
+                ))
+            if stamps:
+                etag = hashlib.md5('|'.join([
+                    request.get_full_path(),
+                    request.META.get('HTTP_ACCEPT', ''),
+                ] + [stamp.isoformat() for stamp in stamps]).encode())
+                self._validators = (etag.hexdigest(), max(stamps))
+            else:
+                self._validators = (None, None)
+        return self._validators
+
+    def conditional(self, view):
+        return condition(
+            etag_func=lambda *args, **kwargs:
+                self.get_validators(*args, **kwargs)[0],
+            last_modified_func=lambda *args, **kwargs:
+                self.get_validators(*args, **kwargs)[1],
+        )(view)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list)(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve)(request, *args, **kwargs)
+
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
 
@@ -126,16 +324,38 @@ class UserViewSet(viewsets.ModelViewSet):
             )
 
 
-class CustomerViewSet(viewsets.ModelViewSet):
+class CustomerViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Customer.objects.all()
-    serializer_class = serializers.CustomerSerializer
+    filter_fields = ('type', )
+    ordering_fields = ('name', 'type')
+
+    def get_serializer_class(self):
+        if self.action in ('balance', 'balances'):
+            return serializers.CustomerBalanceSerializer
+        else:
+            return serializers.CustomerSerializer
+
+    @action(methods=('get', ), detail=True)
+    def balance(self, request, *args, **kwargs):
+        try:
+            pk = int(kwargs['pk'])
+            balance = get_balances(pk)[pk]
+        except (KeyError, ValueError):
+            raise NotFound()
+        return Response(self.get_serializer(balance).data)
+
+    @action(methods=('get', ), detail=False)
+    def balances(self, request, *args, **kwargs):
+        return Response(
+            self.get_serializer(get_balances().values(), many=True).data
+        )
 
     def destroy(self, request, *args, **kwargs):
         response = super().destroy(request, *args, **kwargs)
         return Response({'status': response.status_code})
 
 
-class ContainerViewSet(viewsets.ModelViewSet):
+class ContainerViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Container.objects.all()
     serializer_class = serializers.ContainerSerializer
 
@@ -144,7 +364,7 @@ class ContainerViewSet(viewsets.ModelViewSet):
         return Response({'status': response.status_code})
 
 
-class FlavourViewSet(viewsets.ModelViewSet):
+class FlavourViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Flavour.objects.all()
     serializer_class = serializers.FlavourSerializer
 
@@ -153,27 +373,114 @@ class FlavourViewSet(viewsets.ModelViewSet):
         return Response({'status': response.status_code})
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(
+        ConditionalGetMixin,
+        BulkCreateUpdateMixin,
+        ExportMixin,
+        viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = serializers.ProductSerializer
+    version_models = (Container, Flavour)
+    export_columns = utils.PRODUCT_COLUMNS
+    filter_fields = (
+        'state',
+        'flavour',
+        'container',
+        'arrived_date__gte',
+        'arrived_date__lte',
+    )
+    ordering_fields = ('code', 'arrived_date', 'price', 'state')
 
     def destroy(self, request, *args, **kwargs):
         response = super().destroy(request, *args, **kwargs)
         return Response({'status': response.status_code})
 
+    @action(methods=('get', ), detail=False, )
+    def availability(self, request, *args, **kwargs):
+        # kegs per flavour, container and state, read from the counters
+        # kept with every product write instead of counting products
+        def counts(request, *args, **kwargs):
+            return Response(QueryParamFilter().filter_lookups(
+                request,
+                ProductCount.objects.filter(count__gt=0),
+                ('flavour', 'container', 'state'),
+            ).order_by('flavour', 'container', 'state').values(
+                'flavour', 'container', 'state', 'count'
+            ))
+        return self.conditional(counts)(request, *args, **kwargs)
+
+
+class OrderViewSet(
+        ConditionalGetMixin, ExportMixin, viewsets.ModelViewSet):
+    queryset = Order.objects.select_related('customer').prefetch_related(
+        Prefetch('products', queryset=Product.objects.only('code'))
+    )
+    version_models = (Product, Customer)
+    export_columns = utils.ORDER_COLUMNS
+    export_date_field = 'date'
+    filter_fields = ('state', 'customer', 'date__gte', 'date__lte')
+    ordering_fields = ('date', 'total_amount', 'state')
+    ordering = ('date', 'pk')
 
-class OrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all()
-    serializer_class = serializers.OrderSerializer
+    def get_serializer_class(self):
+        if self.action == 'allocate':
+            return serializers.AllocationSerializer
+        else:
+            return serializers.OrderSerializer
+
+    @action(methods=('post', ), detail=True)
+    def allocate(self, request, *args, **kwargs):
+        order = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        kegs = allocate_products(order, **serializer.validated_data)
+        return Response({
+            'order': order.pk,
+            'products': [{'pk': pk, 'code': code} for pk, code in kegs],
+        })
 
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(
+        ConditionalGetMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = Payment.objects.all()
-    serializer_class = serializers.PaymentSerializer
+    export_columns = utils.PAYMENT_COLUMNS
+    filter_fields = ('method', 'order')
+    ordering_fields = ('transaction', 'amount', 'method')
 
+    def get_serializer_class(self):
+        if self.action == 'installments':
+            return serializers.InstallmentsSerializer
+        else:
+            return serializers.PaymentSerializer
 
-class QuotaViewSet(viewsets.ModelViewSet):
+    @action(methods=('post', ), detail=True)
+    def installments(self, request, *args, **kwargs):
+        payment = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        quotas = payment.schedule_quotas(
+            serializer.validated_data['count'],
+            serializer.validated_data['start_date'],
+            serializer.validated_data['period'],
+        )
+        return Response(
+            serializers.QuotaSerializer(quotas, many=True).data,
+            status=status.HTTP_201_CREATED
+        )
+
+
+class QuotaViewSet(
+        ConditionalGetMixin,
+        BulkCreateUpdateMixin,
+        ExportMixin,
+        viewsets.ModelViewSet):
     queryset = Quota.objects.all()
+    export_columns = utils.QUOTA_COLUMNS
+    filter_fields = ('payment', 'date__gte', 'date__lte')
+    ordering_fields = ('date', 'value', 'current_quota')
+    ordering = ('date', 'pk')
+    # paid and remaining depend on today
+    daily_actions = ('by_payment', )
 
     def get_serializer_class(self):
         if self.action == 'list_by_payment':
@@ -190,6 +497,31 @@ class QuotaViewSet(viewsets.ModelViewSet):
             ).values())
         return Response(qs)
 
+    @action(methods=('get', ), detail=False, )
+    def by_payment(self, request, *args, **kwargs):
+        """
+        ?payment=1,2,3 -> the quotas of each payment, with `paid`, the sum
+        of the ones dated up to today in TIME_ZONE, and `remaining`, of the
+        ones after it. `paid` only follows the schedule, it does not mean
+        the money was received.
+        """
+        try:
+            payments = list(dict.fromkeys(
+                int(pk) for pk in request.query_params['payment'].split(',')
+            ))
+        except (KeyError, ValueError):
+            raise ValidationError(
+                {'payment': ['Expected a comma separated list of ids.']}
+            )
+        if len(payments) > MAX_PAYMENTS:
+            raise ValidationError(
+                {'payment': ['At most %s ids.' % MAX_PAYMENTS]}
+            )
+
+        def summaries(request, *args, **kwargs):
+            return Response(get_payment_quotas(payments))
+        return self.conditional(summaries)(request, *args, **kwargs)
+
 
 class ReportViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = serializers.ReportSerializer
@@ -213,3 +545,28 @@ class ReportViewSet(viewsets.ReadOnlyModelViewSet):
             return JsonResponse(
                 data={'code': 500, 'message': str(e)}, status=500
             )
+
+    @action(methods=('get', ), detail=False, )
+    def stats(self, request, *args, **kwargs):
+        return Response(utils.report_stats())
+
+    @action(methods=('get', ), detail=False, )
+    def daily(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        date_from = serializer.validated_data['date_from']
+        return Response({
+            'orders': DailyOrderTotal.objects.filter(
+                date__gte=date_from
+            ).order_by('date').values('date', 'orders', 'revenue'),
+            'shipments': DailyShipmentTotal.objects.filter(
+                date__gte=date_from
+            ).order_by('date', 'pk').values(
+                'date', 'flavour', 'container', 'kegs', 'liters'
+            ),
+            'payments': DailyPaymentTotal.objects.filter(
+                date__gte=date_from
+            ).order_by('date', 'method').values(
+                'date', 'method', 'payments', 'amount'
+            ),
+        })
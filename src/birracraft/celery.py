@@ -16,3 +16,4 @@ app = Celery('birracraft')
 # pickle the object when using Windows.
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+app.autodiscover_tasks(related_name='utils')
@@ -10,9 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+from celery.schedules import crontab
+from django.core.exceptions import ImproperlyConfigured
 from datetime import timedelta
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -62,7 +65,6 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -70,16 +72,36 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # templates are parsed once per process, also with DEBUG on
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'birracraft.wsgi.application'
 
+ASGI_APPLICATION = 'birracraft.asgi.application'
+
+# How entrypoint.sh serves the project, 'wsgi' (sync gunicorn workers) or
+# 'asgi' (uvicorn workers under gunicorn)
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+
 
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# Connections are kept open for DB_CONN_MAX_AGE seconds (0 closes them after
+# every request) and checked before a request reuses them. Set DB_PGBOUNCER
+# when connecting through pgbouncer in transaction pooling mode, which can
+# not keep server-side cursors open across transactions.
+
+DB_PGBOUNCER = (os.getenv('DB_PGBOUNCER', 'False') == 'True')
+
 DATABASES = {
     'default': {
         # 'ENGINE': 'django.db.backends.sqlite3',
@@ -89,7 +111,11 @@ DATABASES = {
         'USER': os.getenv('DB_USER'),
         'PASSWORD': os.getenv('DB_USER_PASS'),
         'HOST': os.getenv('DB_HOST'),
-        'PORT': 5432
+        'PORT': int(os.getenv('DB_PORT', 5432)),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS':
+            (os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'),
+        'DISABLE_SERVER_SIDE_CURSORS': DB_PGBOUNCER,
     }
 }
 
@@ -132,10 +158,48 @@ STATIC_URL = '/static/'
 
 STATIC_ROOT = '/static/'
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+# Table versions (api.versions) behind ETags and the report, balance and
+# quota caches must be seen by every web and Celery worker process, so the
+# per-process default cache is only good enough for development
+
+if os.getenv('CACHE_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_LOCATION'),
+        }
+    }
+elif not DEBUG:
+    raise ImproperlyConfigured(
+        'CACHE_LOCATION must point to a cache shared by every process '
+        'when DEBUG is off.'
+    )
+
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
 
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')
 
+CELERY_BEAT_SCHEDULE = {
+    'rebuild-daily-totals': {
+        'task': 'api.utils.rebuild_daily_totals',
+        'schedule': crontab(hour=3, minute=0),
+    },
+}
+
+# Generated reports are kept on disk and reused while the data is unchanged
+
+REPORT_CACHE_DIR = os.getenv(
+    'REPORT_CACHE_DIR',
+    os.path.join(tempfile.gettempdir(), 'birracraft-reports')
+)
+
+REPORT_CACHE_TTL = int(os.getenv('REPORT_CACHE_TTL', 60 * 60 * 24))
+
+REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', 20))
+
 # SMTP configuration
 
 EMAIL_BACKEND = os.getenv('EMAIL_BACKEND')
@@ -167,4 +231,10 @@ REST_FRAMEWORK = {
         ('rest_framework_simplejwt.authentication.JWTAuthentication',),
     'DEFAULT_PERMISSION_CLASSES':
         ('rest_framework.permissions.IsAuthenticated', ),
+    'DEFAULT_FILTER_BACKENDS':
+        ('api.filters.QueryParamFilter',
+         'api.filters.OrderingFilter',
+         'api.filters.SparseFieldsFilter', ),
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.OptInCursorPagination',
+    'PAGE_SIZE': 100,
 }
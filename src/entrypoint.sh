@@ -1,7 +1,5 @@
 #/bin/sh
 
-python manage.py makemigrations api --no-input
-python manage.py migrate --no-input
-python manage.py collectstatic --no-input
-
-gunicorn birracraft.wsgi:application --bind 0.0.0.0:8000
+# migrations and static files are applied by the release job
+# (python manage.py release), the server only checks the schema at start
+gunicorn --config gunicorn.conf.py
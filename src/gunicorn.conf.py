@@ -0,0 +1,59 @@
+"""
+Gunicorn settings for the API container, tuned from the environment:
+
+GUNICORN_WORKER_CLASS  sync, gthread or uvicorn (gthread, or uvicorn when
+                       SERVER_MODE is asgi); uvicorn serves birracraft.asgi,
+                       the others birracraft.wsgi
+GUNICORN_WORKERS       worker processes (2 * CPUs + 1)
+GUNICORN_THREADS       threads per gthread worker (4)
+GUNICORN_MAX_REQUESTS  requests a worker serves before it is replaced (1000)
+SCHEMA_WAIT            seconds to wait at start for the release job to apply
+                       pending migrations (60)
+"""
+import os
+
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'uvicorn': 'uvicorn.workers.UvicornWorker',
+}
+
+# CPUs this container may run on, not every CPU of the host
+cpus = len(os.sched_getaffinity(0))
+
+worker = os.getenv(
+    'GUNICORN_WORKER_CLASS',
+    'uvicorn' if os.getenv('SERVER_MODE') == 'asgi' else 'gthread'
+)
+worker_class = WORKER_CLASSES[worker]
+wsgi_app = (
+    'birracraft.asgi:application' if worker == 'uvicorn'
+    else 'birracraft.wsgi:application'
+)
+
+bind = '0.0.0.0:8000'
+workers = int(os.getenv('GUNICORN_WORKERS', 2 * cpus + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4 if worker == 'gthread' else 1))
+
+# Django and its apps are imported once in the master and shared by the
+# forked workers
+preload_app = True
+
+# replace workers now and then so slow leaks can not pile up, at staggered
+# times so they do not all restart together
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+
+def on_starting(server):
+    # the release job migrates, replicas only check the schema is current
+    # before the master forks its workers
+    import django
+    from django.core.management import call_command
+    from django.db import connections
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'birracraft.settings')
+    django.setup()
+    call_command('check_schema', wait=int(os.getenv('SCHEMA_WAIT', 60)))
+    # forked workers must not share the master's connection
+    connections.close_all()